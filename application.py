@@ -18,19 +18,30 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
-import datetime
+import bisect
+import contextlib
+import hashlib
+import logging
 import os
 import os.path
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
 import psycopg2.extras
+import queue
 import re
 import secrets
-import smtplib
+import threading
+import time
+import zlib
 
-from email.message import EmailMessage
-from flask import Flask, g, json, request, Response
+from flask import Flask, g, has_request_context, json, request, Response
 from json.decoder import JSONDecodeError
-from typing import Pattern
+from typing import Pattern, Tuple
+
+from bug_reports import BugReportSender, enqueue_bug_report, validate_bug_report
+from metrics import Counter, Histogram, Registry, normalize_query, query_shape_id
+from result_cache import ResultCache
 
 
 BASE_DIR = os.path.dirname(__file__)
@@ -94,10 +105,131 @@ NON_NEG_INT_DOMAIN = re.compile(r"^\d+$")
 BOOLEAN_DOMAIN = re.compile(r"^(true|false)$")
 POSITION_OPERATOR_DOMAIN = re.compile(r"^(overlap|not_overlap|within)$")
 SORT_ORDER_DOMAIN = re.compile(r"^(ASC|DESC)$")
+ID_LIST_DOMAIN = re.compile(r"^[1-9]\d*(,[1-9]\d*)*$")
+ROW_FORMAT_DOMAIN = re.compile(r"^(objects|columns|rows|ndjson)$")
+COMPARE_FORMAT_DOMAIN = re.compile(r"^(ndjson|tsv)$")
+
+MAX_GENE_SUGGESTIONS = 50
+MAX_BATCH_IDS = 1000
+NDJSON_BATCH_SIZE = 2000
+
+# HTTP caching: responses are cached by clients / proxies for CACHE_MAX_AGE seconds, then re-validated via ETags derived
+# from the dataset version, which is itself only re-checked every DATASET_VERSION_TTL seconds per process.
+CACHE_MAX_AGE = 300
+DATASET_VERSION_TTL = 60
+CACHEABLE_ENDPOINTS = ("datasets", "dataset_index", "variant_guides", "variants_guides", "guides", "variants_entries",
+                       "guides_entries", "variant_fields", "guide_fields", "gene_suggestions", "metadata",
+                       "variant_cartoon", "cartoons")
+
+# Serialized responses of these (hot) endpoints are kept in a cache shared by all worker processes
+RESULT_CACHE_ENDPOINTS = ("dataset_index", "guides", "variants_entries", "guides_entries", "metadata")
+RESULT_CACHE_PATH = os.environ.get("RESULT_CACHE_PATH", os.path.join(BASE_DIR, "result_cache.sqlite3"))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Metrics of all worker processes are aggregated via snapshots in this file
+METRICS_PATH = os.environ.get("METRICS_PATH", os.path.join(BASE_DIR, "metrics.sqlite3"))
+
+# Queries taking longer than SLOW_QUERY_SECONDS are logged (to SLOW_QUERY_LOG_PATH, if set), along with their query
+# plan if SLOW_QUERY_EXPLAIN is true. Note that EXPLAIN ANALYZE runs the slow query a second time. The normalized
+# query for each query shape ID used in metrics is logged (at INFO level) the first time it is seen by a process.
+SLOW_QUERY_SECONDS = float(os.environ.get("SLOW_QUERY_SECONDS", "1"))
+SLOW_QUERY_LOG_PATH = os.environ.get("SLOW_QUERY_LOG_PATH")
+SLOW_QUERY_EXPLAIN = os.environ.get("SLOW_QUERY_EXPLAIN", "false").lower() == "true"
+
+# Clients control the structure of queries (e.g. through search_query and fields), so the number of query shapes is
+# unbounded. Only the first MAX_QUERY_SHAPES shapes seen by a process get their own metrics label; the rest are
+# labelled "other" (the slow query log always includes the actual shape ID.)
+MAX_QUERY_SHAPES = int(os.environ.get("MAX_QUERY_SHAPES", "200"))
+
+# Statement timeouts (in milliseconds) by endpoint, each of which can be overridden with a
+# STATEMENT_TIMEOUT_<ENDPOINT> environment variable. Exports (and background counts) are allowed to run longer, but are
+# still bounded. Exports read rows from server-side cursors in batches, so one stops at the next batch if the client
+# disconnects; a statement already running is only bounded by its timeout.
+DEFAULT_STATEMENT_TIMEOUT = int(os.environ.get("STATEMENT_TIMEOUT", "30000"))
+
+# Maximum number of exact entries counts computed in the background (each with its own connection) at once, per
+# process; further counts are skipped until a slot is free, so that approximate counts cannot exhaust connections.
+MAX_BACKGROUND_COUNTS = int(os.environ.get("MAX_BACKGROUND_COUNTS", "2"))
+STATEMENT_TIMEOUTS = {
+    "variants_tsv": 600000,
+    "variant_guides_tsv": 600000,
+    "guides_tsv": 600000,
+    "combined_tsv": 600000,
+    "compare_datasets": 600000,
+    "variants_entries": 120000,
+    "guides_entries": 120000,
+    "background": 1800000
+}
+
+# Request parameters which affect which rows are matched, used for slow query filter fingerprints
+FILTER_PARAMS = ("chr", "start", "end", "location", "min_mh_1l", "clinvar", "ngg_pam_avail", "unique_guide_avail",
+                 "gene", "search_query", "guides_search_query")
+
+# Variants are matched across datasets by their natural key; PAM / guide statistics are compared side by side. Since
+# (chr, pos_start, pos_end, rs) is not unique when rs is NULL, dataset-independent columns are added as tie-breakers.
+COMPARE_KEY_FIELDS = ("chr", "pos_start", "pos_end", "rs", "var_l", "allele_id", "mh_seq_1")
+# Text is ordered by byte value to match Python string comparison; IDs make the order of any remaining ties stable.
+COMPARE_ORDER = "chr, pos_start, pos_end, rs, var_l, allele_id, mh_seq_1 COLLATE \"C\", id"
+COMPARE_FIELDS = ("id", "pam_mot", "pam_uniq", "guides_no_nmh", "guides_min_nmh", "max_indelphi_freq_mean")
+COMPARE_QUEUE_BATCHES = 4
+
+TABLE_COLUMNS_QUERY = ("SELECT column_name, is_nullable, data_type FROM information_schema.columns "
+                       "WHERE table_schema = 'public' AND table_name = %s ORDER BY ordinal_position")
+DATASET_VERSION_QUERY = "SELECT CAST(s_value AS BIGINT) FROM summary_statistics WHERE s_key = 'dataset_version'"
+FACET_BIN_SIZE_QUERY = "SELECT CAST(s_value AS INTEGER) FROM summary_statistics WHERE s_key = 'facet_bin_size'"
+METADATA_STATISTICS_QUERY = "SELECT s_key, s_value FROM summary_statistics"
+METADATA_HISTOGRAMS_QUERY = ("SELECT column_name, bin_start, bin_end, n_variants FROM histograms "
+                             "ORDER BY column_name, bin")
+GENE_SYMBOLS_QUERY = "SELECT DISTINCT gene_symbol FROM variant_genes"
+
+FACET_COUNTS_SELECTION = "CAST(COALESCE(SUM(n_variants), 0) AS BIGINT), CAST(COALESCE(SUM(n_guides), 0) AS BIGINT)"
 
 app = Flask(__name__)
 
-email_tokens = {}
+result_cache = ResultCache(RESULT_CACHE_PATH, RESULT_CACHE_MAX_BYTES)
+
+bug_report_sender = BugReportSender(lambda: connect_db(BUG_REPORT_DATASET, get_statement_timeout("background")))
+
+slow_query_logger = logging.getLogger("mcb.slow_queries")
+slow_query_logger.setLevel(logging.INFO)
+if SLOW_QUERY_LOG_PATH is not None:
+    slow_query_logger.addHandler(logging.FileHandler(SLOW_QUERY_LOG_PATH))
+
+# Metrics are recorded per worker process, and published periodically so that /metrics covers all of them.
+metrics_registry = Registry(METRICS_PATH)
+request_duration = metrics_registry.register(Histogram(
+    "mcb_request_duration_seconds", "Time spent handling requests (up to the first byte for streamed responses).",
+    ("endpoint", "status")))
+query_duration = metrics_registry.register(Histogram(
+    "mcb_query_duration_seconds", "Time spent executing database queries, by endpoint and query shape.",
+    ("endpoint", "shape")))
+query_rows = metrics_registry.register(Counter(
+    "mcb_query_rows_total", "Rows returned by database queries, by endpoint and query shape.", ("endpoint", "shape")))
+cache_requests = metrics_registry.register(Counter(
+    "mcb_cache_requests_total", "Cache look-ups, by cache and result (hit or miss).", ("cache", "result")))
+db_connect_duration = metrics_registry.register(Histogram(
+    "mcb_db_connect_duration_seconds", "Time spent waiting for new database connections.", ("dataset",)))
+
+# Query shape IDs used as metrics labels (whose normalized query has been logged) by this process
+labelled_query_shapes = set()
+
+# (dataset, entries query) pairs with exact counts currently being computed in the background
+entries_counts_in_progress = set()
+entries_counts_lock = threading.Lock()
+background_count_slots = threading.BoundedSemaphore(MAX_BACKGROUND_COUNTS)
+
+# Column information for tables, keyed by (database name, dataset version, table name), since column types can change
+# when a dataset is re-imported
+table_columns_cache = {}
+
+# (time checked, dataset version) pairs, keyed by dataset
+dataset_versions_cache = {}
+
+# (dataset version, metadata) pairs, keyed by dataset
+metadata_cache = {}
+
+# (dataset version, sorted (upper-cased symbol, symbol) list) pairs for gene autocompletion, keyed by dataset
+gene_symbols_cache = {}
 
 
 class DomainError(Exception):
@@ -107,30 +239,180 @@ class DomainError(Exception):
     pass
 
 
+def current_endpoint() -> str:
+    return (request.endpoint or "unknown") if has_request_context() else "background"
+
+
+def record_cache_request(cache: str, hit: bool):
+    cache_requests.inc(cache, "hit" if hit else "miss")
+
+
+def get_filter_fingerprint() -> str:
+    if not has_request_context():
+        return ""
+    return "&".join(f"{k}={v}" for k, v in sorted(request.args.items(multi=True)) if k in FILTER_PARAMS)
+
+
+def log_slow_query(c, query, duration: float, shape: str):
+    query_str = query.decode("utf-8") if isinstance(query, bytes) else query
+    fingerprint = get_filter_fingerprint()
+    message = (f"slow query ({duration:.3f}s) endpoint={current_endpoint()} shape={shape} "
+               f"filters={fingerprint!r} filters_hash={hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()[:12]}\n"
+               f"{query_str}")
+
+    # Only plain (i.e. side effect-free) SELECT queries are re-run to get their plans.
+    if SLOW_QUERY_EXPLAIN and re.match(r"^\s*\(?\s*SELECT\b", query_str, re.IGNORECASE):
+        try:
+            # A non-instrumented cursor, to avoid recursion
+            with psycopg2.extensions.cursor(c.connection) as c2:
+                c2.execute(f"EXPLAIN (ANALYZE, BUFFERS) {query_str}")
+                message += "\n" + "\n".join(r[0] for r in c2.fetchall())
+        except psycopg2.Error as e:
+            message += f"\nCould not explain query: {e}"
+
+    slow_query_logger.warning(message)
+
+
+def get_query_shape(query) -> Tuple[str, str]:
+    """
+    :return: A tuple of (query shape ID, metrics label for the shape.)
+    """
+
+    normalized_query = normalize_query(query)
+    shape = query_shape_id(normalized_query)
+    if shape not in labelled_query_shapes:
+        if len(labelled_query_shapes) >= MAX_QUERY_SHAPES:
+            return shape, "other"
+        labelled_query_shapes.add(shape)
+        slow_query_logger.info(f"query shape {shape}: {normalized_query}")
+    return shape, shape
+
+
+class InstrumentedCursorMixin:
+    """
+    Records the duration and number of rows of each executed query, grouped by endpoint and query shape.
+    """
+
+    def _record_query(self, query, duration: float):
+        shape, shape_label = get_query_shape(query)
+
+        endpoint = current_endpoint()
+        query_duration.observe(duration, endpoint, shape_label)
+        if self.rowcount >= 0:
+            query_rows.inc(endpoint, shape_label, amount=self.rowcount)
+
+        if duration >= SLOW_QUERY_SECONDS:
+            log_slow_query(self, query, duration, shape)
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self._record_query(self.query if self.query is not None else query, time.perf_counter() - start)
+
+    def executemany(self, query, vars_list):
+        # Recorded once, as the un-formatted query; rowcount is the total for all parameter sets.
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            self._record_query(query, time.perf_counter() - start)
+
+
+instrumented_cursor_classes = {}
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    def cursor(self, *args, **kwargs):
+        cursor_factory = kwargs.get("cursor_factory") or self.cursor_factory or psycopg2.extensions.cursor
+        if cursor_factory not in instrumented_cursor_classes:
+            instrumented_cursor_classes[cursor_factory] = type(f"Instrumented{cursor_factory.__name__}",
+                                                               (InstrumentedCursorMixin, cursor_factory), {})
+        kwargs["cursor_factory"] = instrumented_cursor_classes[cursor_factory]
+        return super().cursor(*args, **kwargs)
+
+
 def verify_domain(value, domain: Pattern):
     if re.match(domain, str(value)):
         return value
     raise DomainError
 
 
-def search_param(c):
-    return f"search_cond_{str(c).strip()}"
+def search_param(c, prefix="search_cond"):
+    return f"{prefix}_{str(c).strip()}"
 
 
-def get_db(dataset="cas"):
-    dbs = getattr(g, "databases", dict())
+def get_statement_timeout(endpoint: str) -> int:
+    return int(os.environ.get(f"STATEMENT_TIMEOUT_{endpoint.upper()}",
+                              STATEMENT_TIMEOUTS.get(endpoint, DEFAULT_STATEMENT_TIMEOUT)))
+
+
+def get_conninfo(dataset: str) -> str:
+    return (f"dbname={DATASETS[dataset]['database']} "
+            f"user={os.environ.get('DB_USER')} "
+            f"password={os.environ.get('DB_PASSWORD')}")
+
+
+def connect_db(dataset: str, statement_timeout: int):
+    start = time.perf_counter()
+    conn = psycopg2.connect(get_conninfo(dataset),
+                            options=f"-c statement_timeout={statement_timeout}",
+                            connection_factory=InstrumentedConnection)
+    db_connect_duration.observe(time.perf_counter() - start, dataset)
+    return conn
+
+
+def get_db(dataset="cas", statement_timeout=None):
+    """
+    Gets the connection for a dataset in the current application context, connecting if necessary. Unless specified,
+    the statement timeout for new connections is taken from the current endpoint.
+    """
+
+    dbs = g.setdefault("databases", dict())
     if dataset not in dbs:
-        g.databases = dict()
-        dbs[dataset] = g.databases[dataset] = psycopg2.connect(f"dbname={DATASETS[dataset]['database']} "
-                                                               f"user={os.environ.get('DB_USER')} "
-                                                               f"password={os.environ.get('DB_PASSWORD')}")
+        dbs[dataset] = connect_db(
+            dataset, statement_timeout if statement_timeout is not None else get_statement_timeout(current_endpoint()))
+        # Used to key column information (see get_table_columns)
+        dbs[dataset].dataset_version = get_cached_dataset_version(dataset)
     return dbs[dataset]
 
 
+@contextlib.contextmanager
+def streaming_db(dataset: str, statement_timeout: int):
+    """
+    Provides a connection for use in a streaming response generator (in a new application context.) If the generator
+    is closed early (i.e. the client disconnected), the connection is closed, ending any server-side cursor. The
+    generator is only closed between yields, when no statement is running, so slow statements are bounded by the
+    statement timeout alone.
+    """
+
+    with app.app_context():
+        yield get_db(dataset, statement_timeout)
+
+
+def table_columns_key(conn, table: str):
+    # The dataset version is set on connections when they are checked out (see get_db.)
+    return conn.info.dbname, getattr(conn, "dataset_version", None), table
+
+
+def store_table_columns(key, rows):
+    table_columns_cache[key] = tuple({"column_name": n, "is_nullable": i, "data_type": d} for n, i, d in rows)
+
+
+def get_table_columns(c, table: str):
+    key = table_columns_key(c.connection, table)
+    if key not in table_columns_cache:
+        # Use a plain cursor, since the passed cursor's row type may vary
+        with c.connection.cursor() as c2:
+            c2.execute(TABLE_COLUMNS_QUERY, (table,))
+            store_table_columns(key, c2.fetchall())
+    return table_columns_cache[key]
+
+
 def get_variants_columns(c):
-    c.execute("SELECT column_name, is_nullable, data_type FROM information_schema.columns "
-              "WHERE table_schema = 'public' AND table_name = 'variants' AND column_name != 'full_row'")
-    return tuple(sorted([dict(i) for i in c.fetchall()], key=lambda i: COLUMN_ORDER.index(i["column_name"])))
+    return tuple(sorted([dict(i) for i in get_table_columns(c, "variants") if i["column_name"] != "full_row"],
+                        key=lambda i: COLUMN_ORDER.index(i["column_name"])))
 
 
 def build_variants_columns_domain(c):
@@ -138,17 +420,169 @@ def build_variants_columns_domain(c):
 
 
 def get_guides_columns(c):
-    c.execute("SELECT column_name, is_nullable, data_type FROM information_schema.columns "
-              "WHERE table_schema = 'public' AND table_name = 'guides'")
-    return tuple([dict(i) for i in c.fetchall()])
+    return tuple([dict(i) for i in get_table_columns(c, "guides")])
+
+
+def get_fields(column_names, args, default_fields=None):
+    """
+    Gets the list of fields to return (a projection of column_names) from the fields request parameter.
+    :return: The requested fields in the order given, or the default fields (all column names unless specified) if no
+             fields were specified.
+    """
+
+    fields = [f.strip() for f in args.get("fields", "").split(",") if f.strip() != ""]
+    if len(fields) == 0:
+        return list(default_fields if default_fields is not None else column_names)
+
+    for f in fields:
+        if f not in column_names:
+            raise DomainError
+    return list(dict.fromkeys(fields))
+
+
+def decompress_cartoon(cartoon_zlib):
+    return zlib.decompress(cartoon_zlib).decode("utf-8") if cartoon_zlib is not None else None
+
+
+def get_id_list(args, param: str = "ids"):
+    ids = [int(i) for i in verify_domain(args.get(param, ""), ID_LIST_DOMAIN).split(",")]
+    if len(ids) > MAX_BATCH_IDS:
+        raise DomainError
+    return list(dict.fromkeys(ids))
+
+
+def get_row_format(args) -> str:
+    return verify_domain(args.get("format", "objects"), ROW_FORMAT_DOMAIN)
+
+
+def rows_body(field_names, rows, row_format: str):
+    """
+    Arranges result rows (as tuples) in the format given: either a list of objects, or a compact encoding with field
+    names listed once and values as arrays, by row ("rows") or by column ("columns").
+    """
+
+    if row_format == "objects":
+        return [dict(zip(field_names, r)) for r in rows]
+    if row_format == "rows":
+        return {"fields": field_names, "rows": rows}
+    return {"fields": field_names, "columns": [list(col) for col in zip(*rows)] or [[] for _ in field_names]}
+
+
+def compact_json(body) -> str:
+    # Uses the same (standard library) encoder as jsonify; only the output is more compact, without whitespace or
+    # key sorting. Payload size is reduced by the compact row formats (see rows_body), not by a faster encoder.
+    return json.dumps(body, sort_keys=False, separators=(",", ":"))
+
+
+def ndjson_lines(field_names, rows, row_transform=None) -> str:
+    return "".join(compact_json(dict(zip(field_names, row_transform(r) if row_transform else r))) + "\n"
+                   for r in rows)
 
 
-def build_search_query(raw_query, c):
+def tsv_line(row) -> str:
+    return "\t".join([str(col) if col is not None else "NA" for col in row]) + "\n"
+
+
+def rows_response(field_names, rows) -> Response:
+    """
+    Serializes result rows (as tuples) in the format specified by the format request parameter (see rows_body.)
+    """
+
+    row_format = get_row_format(request.args)
+    body = rows_body(field_names, rows, row_format)
+    return json.jsonify(body) if row_format == "objects" else Response(compact_json(body), mimetype="application/json")
+
+
+def listing_response(dataset: str, c, query, field_names, row_transform=None) -> Response:
+    """
+    Runs a listing query and returns its rows in the requested format. For format=ndjson, rows are streamed from a
+    server-side cursor in batches as newline-delimited JSON objects, so memory use does not grow with result size.
+    """
+
+    if get_row_format(request.args) == "ndjson":
+        statement_timeout = get_statement_timeout(request.endpoint)
+
+        def generate():
+            with streaming_db(dataset, statement_timeout) as conn:
+                c2 = conn.cursor("ndjson-cursor")
+                c2.itersize = NDJSON_BATCH_SIZE
+                c2.execute(query)
+
+                rows = c2.fetchmany(NDJSON_BATCH_SIZE)
+                while len(rows) > 0:
+                    yield ndjson_lines(field_names, rows, row_transform)
+                    rows = c2.fetchmany(NDJSON_BATCH_SIZE)
+
+        return Response(generate(), mimetype="application/x-ndjson")
+
+    c.execute(query)
+    results = c.fetchall()
+    return rows_response(field_names, [row_transform(r) for r in results] if row_transform else results)
+
+
+def build_guides_columns_domain(c):
+    return re.compile(f"^({'|'.join([i['column_name'] for i in get_guides_columns(c)])})$")
+
+
+def numeric_value(x):
+    return int(x) if x == int(x) else float(x)
+
+
+def get_dataset_version(c):
+    c.execute(DATASET_VERSION_QUERY)
+    version = c.fetchone()
+    return version[0] if version is not None else None
+
+
+def get_cached_dataset_version(dataset: str):
+    now = time.monotonic()
+    if dataset not in dataset_versions_cache or now - dataset_versions_cache[dataset][0] > DATASET_VERSION_TTL:
+        dataset_versions_cache[dataset] = (now, get_dataset_version(get_db(dataset).cursor()))
+    return dataset_versions_cache[dataset][1]
+
+
+def build_etag(dataset_version, path: str, args) -> str:
+    """
+    Builds a strong ETag from the application version, dataset version and canonical (sorted) request parameters.
+    """
+
+    canonical_args = "&".join(f"{k}={v}" for k, v in sorted(args.items(multi=True)))
+    etag_key = f"{__version__}:{dataset_version}:{path}?{canonical_args}"
+    return hashlib.sha256(etag_key.encode("utf-8")).hexdigest()
+
+
+def get_gene_symbols(dataset: str, c):
+    # Re-loaded when the dataset is re-imported
+    dataset_version = get_cached_dataset_version(dataset)
+    if dataset not in gene_symbols_cache or gene_symbols_cache[dataset][0] != dataset_version:
+        c.execute(GENE_SYMBOLS_QUERY)
+        gene_symbols_cache[dataset] = (dataset_version, sorted((r[0].upper(), r[0]) for r in c.fetchall()))
+    return gene_symbols_cache[dataset][1]
+
+
+def match_gene_symbols(gene_symbols, args):
+    """
+    Finds gene symbols starting with the (case-insensitive) prefix parameter, up to the limit parameter.
+    """
+
+    prefix = args.get("prefix", "").strip().upper()
+    limit = min(int(verify_domain(args.get("limit", "10"), POS_INT_DOMAIN)), MAX_GENE_SUGGESTIONS)
+
+    results = []
+    for key, symbol in gene_symbols[bisect.bisect_left(gene_symbols, (prefix,)):]:
+        if not key.startswith(prefix) or len(results) >= limit:
+            break
+        results.append(symbol)
+
+    return results
+
+
+def build_search_query(raw_query, c, columns=None, prefix="search_cond", full_row=True):
     search_query_fragment = ""
     search_query_data = {}
 
     try:
-        column_names = [c["column_name"] for c in get_variants_columns(c)]
+        column_names = [c["column_name"] for c in (columns if columns is not None else get_variants_columns(c))]
 
         query_obj = json.loads(raw_query)
         for c in query_obj:
@@ -166,13 +600,18 @@ def build_search_query(raw_query, c):
             search_query_fragment += f"({'NOT ' if c['negated'] else ''}({c['field']} {op_data[0]}"
 
             if op_data[1] != "":
-                search_query_fragment += f" %({search_param(c['id'])})s"
-                search_query_data[search_param(c["id"])] = op_data[1].format(c["value"])
+                search_query_fragment += f" %({search_param(c['id'], prefix)})s"
+                search_query_data[search_param(c["id"], prefix)] = op_data[1].format(c["value"])
 
             search_query_fragment += "))"
 
+        if search_query_fragment == "":
+            # No valid conditions were specified
+            return "true", search_query_data
+
     except (JSONDecodeError, TypeError, AttributeError):
-        if raw_query.strip() == "":
+        if raw_query.strip() == "" or not full_row:
+            # Free-text search is only available for tables with a full_row column
             return "true", search_query_data
 
         search_query_fragment = "full_row LIKE %(full_row_cond)s "
@@ -181,32 +620,41 @@ def build_search_query(raw_query, c):
     return search_query_fragment, search_query_data
 
 
-def get_search_params_from_request(c):
+def get_search_params(c, args):
     # Ensure chromosomes match spec. Make chrx/chry into chrX/chrY.
-    chromosomes = [ch.upper().replace("CHR", "chr") for ch in request.args.get("chr", ",".join(CHR_VALUES)).split(",")
+    chromosomes = [ch.upper().replace("CHR", "chr") for ch in args.get("chr", ",".join(CHR_VALUES)).split(",")
                    if re.match(CHR_DOMAIN, ch.upper().replace("CHR", "chr"))]
     chr_fragment = "(" + ",".join([f"'{ch}'::CHROMOSOME" for ch in chromosomes]) + ")"
     if len(chromosomes) == 0:
         chr_fragment = "(" + ",".join([f"'{ch}'::CHROMOSOME" for ch in CHR_VALUES]) + ")"
 
-    start_pos = int(verify_domain(request.args.get("start", "0"), NON_NEG_INT_DOMAIN))
-    end_pos = int(verify_domain(request.args.get("end", "1000000000000"), POS_INT_DOMAIN))
+    start_pos = int(verify_domain(args.get("start", "0"), NON_NEG_INT_DOMAIN))
+    end_pos = int(verify_domain(args.get("end", "1000000000000"), POS_INT_DOMAIN))
     position_filter_fragment = ("pos_start <= %(end_pos)s AND pos_end >= %(start_pos)s"
                                 if not (start_pos == 0 and end_pos == 1000000000000) else "true")
 
-    gene_locations = [l.strip() for l in request.args.get("location", "").split(",") if l.strip() in LOCATION_VALUES]
+    gene_locations = [l.strip() for l in args.get("location", "").split(",") if l.strip() in LOCATION_VALUES]
     if len(gene_locations) == 0:
         gene_locations = list(LOCATION_VALUES)
     location_fragment = "(" + ",".join([f"'{l}'::VARIANT_LOCATION" for l in gene_locations]) + ")"
 
-    min_mh_1l = int(verify_domain(request.args.get("min_mh_1l", "3"), NON_NEG_INT_DOMAIN))
+    min_mh_1l = int(verify_domain(args.get("min_mh_1l", "3"), NON_NEG_INT_DOMAIN))
+
+    clinvar = verify_domain(args.get("clinvar", "false"), BOOLEAN_DOMAIN) == "true"
 
-    clinvar = verify_domain(request.args.get("clinvar", "false"), BOOLEAN_DOMAIN) == "true"
+    ngg_pam_avail = verify_domain(args.get("ngg_pam_avail", "false"), BOOLEAN_DOMAIN) == "true"
+    unique_guide_avail = verify_domain(args.get("unique_guide_avail", "false"), BOOLEAN_DOMAIN) == "true"
 
-    ngg_pam_avail = verify_domain(request.args.get("ngg_pam_avail", "false"), BOOLEAN_DOMAIN) == "true"
-    unique_guide_avail = verify_domain(request.args.get("unique_guide_avail", "false"), BOOLEAN_DOMAIN) == "true"
+    # Genes can be specified either by symbol (case-insensitive) or by NCBI gene ID
+    genes = [gn.strip() for gn in args.get("gene", "").split(",") if gn.strip() != ""]
+    gene_symbols = [gn.upper() for gn in genes if not re.match(POS_INT_DOMAIN, gn)]
+    gene_ids = [int(gn) for gn in genes if re.match(POS_INT_DOMAIN, gn)]
+    gene_fragment = " OR ".join((
+        *(("UPPER(gene_symbol) = ANY(%(gene_symbols)s)",) if len(gene_symbols) > 0 else ()),
+        *(("gene_id = ANY(%(gene_ids)s)",) if len(gene_ids) > 0 else ()),
+    ))
 
-    search_query_fragment, search_query_data = build_search_query(request.args.get("search_query", ""), c)
+    search_query_fragment, search_query_data = build_search_query(args.get("search_query", ""), c)
 
     return {
         "chr": chromosomes,
@@ -226,11 +674,27 @@ def get_search_params_from_request(c):
         "ngg_pam_avail": ngg_pam_avail,
         "unique_guide_avail": unique_guide_avail,
 
+        "genes": genes,
+        "gene_symbols": gene_symbols,
+        "gene_ids": gene_ids,
+        "gene_fragment": gene_fragment,
+
         "search_query_fragment": search_query_fragment,
         "search_query_data": search_query_data
     }
 
 
+def get_guides_search_params(c, args):
+    guides_search_query_fragment, guides_search_query_data = build_search_query(
+        args.get("guides_search_query", ""), c, columns=get_guides_columns(c), prefix="guides_search_cond",
+        full_row=False)
+
+    return {
+        "guides_search_query_fragment": guides_search_query_fragment,
+        "guides_search_query_data": guides_search_query_data
+    }
+
+
 def build_variants_query(c, selection, search_params, cartoons=False, sort_by=None, sort_order=None, page=None,
                          items_per_page=None, outer_query=True):
     outer_selection = (f"SELECT {selection} FROM variants "
@@ -241,6 +705,8 @@ def build_variants_query(c, selection, search_params, cartoons=False, sort_by=No
     loc_in = (f"(location IN {search_params['location_fragment']}) AND "
               if len(search_params["location"]) < len(LOCATION_VALUES) else "")
     mh_1l = "(mh_1l >= %(min_mh_1l)s) AND " if search_params["min_mh_1l"] > 0 else ""
+    gene_in = (f"(id IN (SELECT variant_id FROM variant_genes WHERE {search_params['gene_fragment']})) AND "
+               if len(search_params["genes"]) > 0 else "")
 
     limit = "LIMIT %(items_per_page)s " if items_per_page is not None else ""
     offset = "OFFSET %(start)s" if page is not None else ""
@@ -249,7 +715,7 @@ def build_variants_query(c, selection, search_params, cartoons=False, sort_by=No
 
     return c.mogrify(
         f"{outer_selection} (SELECT {selection if not outer_query else 'id'} FROM variants "
-        f"WHERE {chr_in}{loc_in}{mh_1l} NOT (%(clinvar)s AND gene_info_clinvar IS NULL) "
+        f"WHERE {chr_in}{loc_in}{mh_1l}{gene_in} NOT (%(clinvar)s AND gene_info_clinvar IS NULL) "
         f"AND (pam_mot > 0 OR NOT %(ngg_pam_avail)s) AND (pam_uniq > 0 OR NOT %(unique_guide_avail)s) "
         f"AND ({search_params['position_filter_fragment']}) AND ({search_params['search_query_fragment']}) "
         f"{order_string}{limit}{offset}) {order_string if outer_query else ''}",
@@ -262,21 +728,362 @@ def build_variants_query(c, selection, search_params, cartoons=False, sort_by=No
             "clinvar": search_params["clinvar"],
             "ngg_pam_avail": search_params["ngg_pam_avail"],
             "unique_guide_avail": search_params["unique_guide_avail"],
+            "gene_symbols": search_params["gene_symbols"],
+            "gene_ids": search_params["gene_ids"],
             **search_params["search_query_data"]
         }
     )
 
 
+def query_str(query) -> str:
+    # Depending on the driver, mogrified queries are either bytes or strings
+    return query.decode("utf-8") if isinstance(query, bytes) else query
+
+
 def build_variants_query_str(*args, **kwargs):
-    return build_variants_query(*args, **kwargs).decode("utf-8")
+    return query_str(build_variants_query(*args, **kwargs))
 
 
-def get_entries_with_cache(dataset: str, c, query):
+def build_guides_query(c, selection, search_params, guides_search_params, sort_by=None, sort_order=None, page=None,
+                       items_per_page=None, variants_query_kwargs=None):
+    """
+    Builds a query for guides of variants matching the variant search parameters, filtered by any guide conditions.
+    Sorting and pagination apply to the guides themselves; pagination of the variant sub-query can be specified
+    separately via variants_query_kwargs.
+    """
+
+    # The variants sub-query has already been formatted, so any percent signs in it must be escaped.
+    variants_query = build_variants_query_str(c, "id", search_params, outer_query=False,
+                                              **(variants_query_kwargs or {})).replace("%", "%%")
+
+    limit = "LIMIT %(items_per_page)s " if items_per_page is not None else ""
+    offset = "OFFSET %(start)s" if page is not None else ""
+
+    # NULLs (i.e. NA) are always ranked last, with IDs as a tie-breaker for stable pagination.
+    order_string = (f"ORDER BY {sort_by} {sort_order} NULLS LAST{', id' if sort_by != 'id' else ''} "
+                    if sort_by is not None and sort_order is not None else "")
+
+    return c.mogrify(
+        f"SELECT {selection} FROM guides WHERE variant_id IN ({variants_query}) "
+        f"AND ({guides_search_params['guides_search_query_fragment']}) {order_string}{limit}{offset}",
+        {
+            "start": ((page if page is not None else 0) - 1) * (items_per_page if items_per_page is not None else 0),
+            "items_per_page": items_per_page,
+            **guides_search_params["guides_search_query_data"]
+        }
+    )
+
+
+def build_guides_query_str(*args, **kwargs):
+    return query_str(build_guides_query(*args, **kwargs))
+
+
+def get_page(args):
+    return (int(verify_domain(args.get("page", "1"), POS_INT_DOMAIN)),
+            int(verify_domain(args.get("items_per_page", "100"), POS_INT_DOMAIN)))
+
+
+def get_variants_sort(c, args):
+    return (verify_domain(args.get("sort_by", "id"), build_variants_columns_domain(c)),
+            verify_domain(args.get("sort_order", "ASC").upper(), SORT_ORDER_DOMAIN))
+
+
+def get_guides_sort(c, args):
+    return (verify_domain(args["guides_sort_by"], build_guides_columns_domain(c)) if "guides_sort_by" in args else None,
+            verify_domain(args.get("guides_sort_order", "ASC").upper(), SORT_ORDER_DOMAIN))
+
+
+def get_guides_with_variant_info(args) -> bool:
+    return args.get("guides_with_variant_info", "true").lower() == "true"
+
+
+def build_dataset_index_query(c, args):
+    """
+    Builds the query for a page of variants from the listing request parameters.
+    :return: A tuple of (query, field names, function transforming result rows or None.)
+    """
+
+    column_names = [i["column_name"] for i in get_variants_columns(c)]
+
+    # Cartoons are large relative to the rest of a row; they are only included if explicitly requested, and can
+    # otherwise be loaded separately (see variant_cartoon and cartoons.)
+    fields = get_fields(column_names + ["cartoon"], args, column_names)
+    if verify_domain(args.get("cartoons", "false"), BOOLEAN_DOMAIN) == "true" and "cartoon" not in fields:
+        fields.append("cartoon")
+
+    page, items_per_page = get_page(args)
+    sort_by, sort_order = get_variants_sort(c, args)
+
+    query = build_variants_query(
+        c,
+        ", ".join(f"variants.{f}" if f != "cartoon" else "cartoon_zlib AS cartoon" for f in fields),
+        get_search_params(c, args),
+        cartoons="cartoon" in fields,
+        sort_by=sort_by,
+        sort_order=sort_order,
+        page=page,
+        items_per_page=items_per_page
+    )
+
+    if "cartoon" in fields:
+        ci = fields.index("cartoon")
+
+        def row_transform(r):
+            return *r[:ci], decompress_cartoon(r[ci]), *r[ci+1:]
+    else:
+        row_transform = None
+
+    return query, fields, row_transform
+
+
+def build_guides_listing_query(c, args):
+    """
+    Builds the query for a page of guides from the listing request parameters. If guides_sort_by is specified, guides
+    are ranked across all matching variants and pagination applies to the guides themselves; otherwise, all (matching)
+    guides for the current page of variants are returned.
+    :return: A tuple of (query, field names.)
+    """
+
+    page, items_per_page = get_page(args)
+
+    fields = get_fields([i["column_name"] for i in get_guides_columns(c)], args)
+
+    search_params = get_search_params(c, args)
+    guides_search_params = get_guides_search_params(c, args)
+
+    if "guides_sort_by" in args:
+        sort_by, sort_order = get_guides_sort(c, args)
+        return build_guides_query(c, ", ".join(fields), search_params, guides_search_params, sort_by=sort_by,
+                                  sort_order=sort_order, page=page, items_per_page=items_per_page), fields
+
+    sort_by, sort_order = get_variants_sort(c, args)
+    return build_guides_query(
+        c,
+        ", ".join(fields),
+        search_params,
+        guides_search_params,
+
+        sort_by="id",
+        sort_order="ASC",
+
+        variants_query_kwargs={
+            "sort_by": sort_by,
+            "sort_order": sort_order,
+
+            "page": page,
+            "items_per_page": items_per_page
+        }
+    ), fields
+
+
+def build_variants_guides_query(c, args):
+    """
+    Builds the query for all guides of a batch of variants, specified as a comma-separated list of IDs in the ids
+    parameter. The variant ID is always selected first, for grouping (see group_guides_by_variant.)
+    :return: A tuple of (query, variant IDs, field names.)
+    """
+
+    ids = get_id_list(args)
+    fields = get_fields([i["column_name"] for i in get_guides_columns(c)], args)
+
+    # Guides are clustered by variant ID, so the guides for each variant are read from contiguous pages.
+    return c.mogrify(f"SELECT variant_id, {', '.join(fields)} FROM guides WHERE variant_id = ANY(%s) "
+                     f"ORDER BY variant_id, id", (ids,)), ids, fields
+
+
+def group_guides_by_variant(ids, fields, rows):
+    guides_by_variant = {v_id: [] for v_id in ids}
+    for r in rows:
+        guides_by_variant[r[0]].append(dict(zip(fields, r[1:])))
+    return guides_by_variant
+
+
+def build_compare_query(c, args):
+    """
+    Builds the query for the keys and PAM / guide statistics of all variants matching the request parameters in a
+    dataset, ordered by their natural key (see COMPARE_KEY_FIELDS) so that datasets can be merge-joined.
+    """
+
+    return build_variants_query(c, ", ".join(COMPARE_KEY_FIELDS + COMPARE_FIELDS), get_search_params(c, args),
+                                sort_by=COMPARE_ORDER, sort_order="ASC", outer_query=False)
+
+
+def compare_key(row):
+    # Matches the ordering of build_compare_query: chromosomes in enum order, then other key fields with NULLs last
+    return (CHR_VALUES.index(row[0]), *((v is None, v) for v in row[1:len(COMPARE_KEY_FIELDS)]))
+
+
+def merge_compared_rows(rows, other_rows):
+    """
+    Merge-joins two streams of rows ordered by compare_key, as a full outer join.
+    :return: A generator of (row or None, other row or None) pairs.
+    """
+
+    row, other_row = next(rows, None), next(other_rows, None)
+    while row is not None or other_row is not None:
+        if other_row is None or (row is not None and compare_key(row) < compare_key(other_row)):
+            yield row, None
+            row = next(rows, None)
+        elif row is None or compare_key(other_row) < compare_key(row):
+            yield None, other_row
+            other_row = next(other_rows, None)
+        else:
+            yield row, other_row
+            row, other_row = next(rows, None), next(other_rows, None)
+
+
+def compared_rows_differ(row, other_row) -> bool:
+    # IDs are specific to each dataset, so they are not compared.
+    n_key = len(COMPARE_KEY_FIELDS)
+    return row is None or other_row is None or row[n_key+1:] != other_row[n_key+1:]
+
+
+def compare_header(dataset: str, other_dataset: str) -> str:
+    return "\t".join((*COMPARE_KEY_FIELDS, *(f"{dataset}_{f}" for f in COMPARE_FIELDS),
+                      *(f"{other_dataset}_{f}" for f in COMPARE_FIELDS))) + "\n"
+
+
+def compare_line(dataset: str, other_dataset: str, row, other_row, row_format: str) -> str:
+    n_key = len(COMPARE_KEY_FIELDS)
+    key = (row if row is not None else other_row)[:n_key]
+
+    if row_format == "tsv":
+        return tsv_line((*key, *(row[n_key:] if row is not None else (None,) * len(COMPARE_FIELDS)),
+                         *(other_row[n_key:] if other_row is not None else (None,) * len(COMPARE_FIELDS))))
+
+    return compact_json({
+        **dict(zip(COMPARE_KEY_FIELDS, key)),
+        dataset: dict(zip(COMPARE_FIELDS, row[n_key:])) if row is not None else None,
+        other_dataset: dict(zip(COMPARE_FIELDS, other_row[n_key:])) if other_row is not None else None
+    }) + "\n"
+
+
+def fetch_in_background(dataset: str, query, statement_timeout: int, cursor_name: str):
+    """
+    Runs a query on a new connection in a separate thread, fetching its rows from a server-side cursor into a bounded
+    queue of batches, so that queries on several datasets run concurrently without holding their results in memory.
+    :return: A tuple of (generator of result rows, function cancelling the query.)
+    """
+
+    conn = connect_db(dataset, statement_timeout)
+    batches = queue.Queue(maxsize=COMPARE_QUEUE_BATCHES)
+    stopped = threading.Event()
+
+    def put(item):
+        # Give up if the rows are no longer wanted, rather than waiting for the queue forever
+        while not stopped.is_set():
+            try:
+                batches.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def fetch():
+        try:
+            c = conn.cursor(cursor_name)
+            c.execute(query)
+            rows = c.fetchmany(NDJSON_BATCH_SIZE)
+            while len(rows) > 0 and not stopped.is_set():
+                put(rows)
+                rows = c.fetchmany(NDJSON_BATCH_SIZE)
+            put(rows)
+        except Exception as e:
+            # Any error must reach the consumer, which would otherwise wait for more rows forever
+            put(e)
+        finally:
+            conn.close()
+
+    def rows():
+        while True:
+            batch = batches.get()
+            if isinstance(batch, Exception):
+                raise batch
+            if len(batch) == 0:
+                return
+            yield from batch
+
+    def cancel():
+        stopped.set()
+        try:
+            conn.cancel()
+        except psycopg2.Error:
+            pass  # Already finished
+
+    threading.Thread(target=fetch, daemon=True).start()
+    return rows(), cancel
+
+
+def build_variants_tsv_query(c, args):
+    """
+    :return: A tuple of (query for all matching variants, column names.)
+    """
+
+    column_names = [i["column_name"] for i in get_variants_columns(c)]
+    sort_by, sort_order = get_variants_sort(c, args)
+    return build_variants_query(c, ",".join(column_names), get_search_params(c, args), sort_by=sort_by,
+                                sort_order=sort_order), column_names
+
+
+def build_guides_tsv_query(c, args):
+    """
+    :return: A tuple of (query for all matching guides, with variant information unless disabled, column names.)
+    """
+
+    variant_column_names = [i["column_name"] for i in get_variants_columns(c)]
+    column_names = [i["column_name"] for i in get_guides_columns(c)]
+
+    sort_by, sort_order = get_guides_sort(c, args)
+    guides_query_str = build_guides_query_str(c, "*", get_search_params(c, args), get_guides_search_params(c, args),
+                                              sort_by=sort_by, sort_order=sort_order)
+
+    if not get_guides_with_variant_info(args):
+        return guides_query_str, column_names
+
+    return (f"SELECT {', '.join([f'variants.{col}' for col in variant_column_names[1:]])}, "
+            f"guides.* FROM variants RIGHT JOIN ({guides_query_str}) AS guides "
+            f"ON variants.id = guides.variant_id"
+            f"{f' ORDER BY guides.{sort_by} {sort_order} NULLS LAST' if sort_by is not None else ''}",
+            variant_column_names[1:] + column_names)
+
+
+def build_combined_tsv_query(c, args):
+    """
+    :return: A tuple of (query for all matching variants, variant column names, guide column names.) Guides are
+             fetched for each variant separately.
+    """
+
+    sort_by, sort_order = get_variants_sort(c, args)
+    variants_column_names = [i["column_name"] for i in get_variants_columns(c)]
+    return (build_variants_query(c, ",".join(variants_column_names), get_search_params(c, args), sort_by, sort_order),
+            variants_column_names, [i["column_name"] for i in get_guides_columns(c)])
+
+
+def combined_tsv_lines(row, guide_rows, n_variant_columns: int, guides_with_variant_info: bool):
+    row_to_return = [str(col) if col is not None else "NA" for col in row]
+
+    if len(guide_rows) == 0 or not guides_with_variant_info:
+        # No guides, or displaying guides with variant info is disabled
+        yield "\t".join(row_to_return) + "\n"
+
+    for guide_row in guide_rows:
+        guide_info = [str(col) if col is not None else "NA" for col in guide_row]
+        if guides_with_variant_info:
+            yield "\t".join(row_to_return + guide_info) + "\n"
+        else:
+            yield "\t".join(([""] * n_variant_columns) + guide_info) + "\n"
+
+
+def get_cached_entries(c, query):
     c.execute("SELECT * FROM entries_query_cache WHERE e_query = %s::bytea", (query,))
     cache_value = c.fetchone()
+    record_cache_request("entries", cache_value is not None)
+    return cache_value[1] if cache_value is not None else None
+
 
-    if cache_value is not None:
-        return cache_value[1]
+def get_entries_with_cache(dataset: str, c, query):
+    cached_entries = get_cached_entries(c, query)
+    if cached_entries is not None:
+        return cached_entries
 
     c.execute(query)
     num_entries = c.fetchone()[0]
@@ -286,6 +1093,254 @@ def get_entries_with_cache(dataset: str, c, query):
     return num_entries
 
 
+def count_entries_in_background(dataset: str, query):
+    """
+    Computes the exact number of entries for a count query in a separate thread (with its own connection) and stores
+    it in the entries query cache, so that subsequent requests for the same count are exact. The count is skipped if
+    MAX_BACKGROUND_COUNTS are already running; it will be attempted again by a later request.
+    """
+
+    with entries_counts_lock:
+        if (dataset, query) in entries_counts_in_progress:
+            return
+        if not background_count_slots.acquire(blocking=False):
+            return
+        entries_counts_in_progress.add((dataset, query))
+
+    def count():
+        try:
+            conn = connect_db(dataset, get_statement_timeout("background"))
+            try:
+                c = conn.cursor()
+                c.execute(query)
+                c.execute("INSERT INTO entries_query_cache VALUES(%s::bytea, %s) ON CONFLICT DO NOTHING ",
+                          (query, c.fetchone()[0]))
+                conn.commit()
+            finally:
+                conn.close()
+        except psycopg2.Error as e:
+            slow_query_logger.warning(f"background count failed: {e}\n{query_str(query)}")
+        finally:
+            with entries_counts_lock:
+                entries_counts_in_progress.discard((dataset, query))
+            background_count_slots.release()
+
+    threading.Thread(target=count, daemon=True).start()
+
+
+def get_approximate_entries_with_cache(dataset: str, c, query, estimate_query):
+    """
+    Returns the cached exact number of entries for a count query if available. Otherwise, returns the query planner's
+    row estimate for the un-aggregated version of the query, and starts computing the exact count in the background.
+    :return: A tuple of (number of entries, whether the number is approximate).
+    """
+
+    cached_entries = get_cached_entries(c, query)
+    if cached_entries is not None:
+        return cached_entries, False
+
+    count_entries_in_background(dataset, query)
+
+    c.execute(b"EXPLAIN (FORMAT JSON) " + estimate_query)
+    return int(c.fetchone()[0][0]["Plan"]["Plan Rows"]), True
+
+
+def entries_body(num_entries, approximate_requested: bool, approximate: bool = False):
+    if not approximate_requested:
+        return num_entries
+    return {"entries": num_entries, "approximate": approximate}
+
+
+def entries_response(num_entries, approximate_requested: bool, approximate: bool = False) -> Response:
+    return json.jsonify(entries_body(num_entries, approximate_requested, approximate))
+
+
+def can_use_facet_counts(search_params) -> bool:
+    # Free-text, JSON search and gene conditions are not part of the pre-computed facets.
+    return search_params["search_query_fragment"] == "true" and len(search_params["genes"]) == 0
+
+
+def needs_facet_bin_size(search_params) -> bool:
+    return search_params["position_filter_fragment"] != "true"
+
+
+def build_facet_counts_query(c, search_params, bin_size=None):
+    """
+    Builds a query for variant and guide entries counts over the pre-computed facet count tables. Any part of a
+    position filter which does not cover whole position bins (of size bin_size) is returned as search parameters,
+    which must be counted live and added to the pre-computed counts.
+    :return: None if the search cannot be answered from the facet counts; otherwise, a tuple of (query, remainder
+             search parameters or None).
+    """
+
+    if not can_use_facet_counts(search_params):
+        return None
+
+    facet_data = {
+        "min_mh_1l": search_params["min_mh_1l"],
+        "clinvar": search_params["clinvar"],
+        "ngg_pam_avail": search_params["ngg_pam_avail"],
+        "unique_guide_avail": search_params["unique_guide_avail"]
+    }
+
+    facet_conditions = (f"chr IN {search_params['chr_fragment']} AND location IN {search_params['location_fragment']} "
+                        f"AND mh_1l >= %(min_mh_1l)s AND (clinvar OR NOT %(clinvar)s) "
+                        f"AND (ngg_pam_avail OR NOT %(ngg_pam_avail)s) "
+                        f"AND (unique_guide_avail OR NOT %(unique_guide_avail)s)")
+
+    if not needs_facet_bin_size(search_params):
+        return (c.mogrify(f"SELECT {FACET_COUNTS_SELECTION} FROM facet_counts WHERE {facet_conditions}", facet_data),
+                None)
+
+    # Bins [first_bin, last_bin) lie entirely within the position filter, so any variant starting in them overlaps.
+    first_bin = -(-search_params["start_pos"] // bin_size)
+    last_bin = (search_params["end_pos"] + 1) // bin_size
+    if last_bin <= first_bin:
+        return None
+
+    return c.mogrify(f"SELECT {FACET_COUNTS_SELECTION} FROM facet_bin_counts "
+                     f"WHERE pos_bin >= %(first_bin)s AND pos_bin < %(last_bin)s AND {facet_conditions}",
+                     {**facet_data, "first_bin": first_bin, "last_bin": last_bin}), {
+        **search_params,
+        "position_filter_fragment": (f"{search_params['position_filter_fragment']} AND "
+                                     f"(pos_start < {first_bin * bin_size} OR pos_start >= {last_bin * bin_size})")
+    }
+
+
+def get_facet_counts(c, search_params):
+    """
+    Attempts to answer variant and guide entries counts from the pre-computed facet count tables.
+    :return: None if the search cannot be answered from the facet counts (i.e. it has free-text, JSON search or gene
+             conditions); otherwise, a tuple of (variant count, guide count, remainder search parameters or None).
+    """
+
+    if not can_use_facet_counts(search_params):
+        return None
+
+    bin_size = None
+    if needs_facet_bin_size(search_params):
+        c.execute(FACET_BIN_SIZE_QUERY)
+        bin_size = c.fetchone()[0]
+
+    facet_query = build_facet_counts_query(c, search_params, bin_size)
+    if facet_query is None:
+        return None
+
+    c.execute(facet_query[0])
+    n_variants, n_guides = c.fetchone()
+    return n_variants, n_guides, facet_query[1]
+
+
+def build_metadata(statistics_rows, histogram_rows, dataset_version):
+    """
+    Builds the (cacheable part of the) metadata response from summary statistics and histogram rows.
+    """
+
+    statistics = {k: numeric_value(v) for k, v in statistics_rows}
+
+    histograms = {}
+    for col, bin_start, bin_end, n_variants in histogram_rows:
+        histograms.setdefault(col, []).append({
+            "bin_start": numeric_value(bin_start),
+            "bin_end": numeric_value(bin_end),
+            "n_variants": n_variants
+        })
+
+    return {
+        "min_pos": statistics.get("min_pos"),
+        "max_pos": statistics.get("max_pos"),
+        "max_mh_l": statistics.get("max_mh_l"),
+        "max_mh_1l": statistics.get("max_mh_1l"),
+        "n_variants": statistics.get("n_variants"),
+        "n_guides": statistics.get("n_guides"),
+        "n_cartoons": statistics.get("n_cartoons"),
+        "chr_positions": {ch: {"min_pos": statistics[f"min_pos_{ch}"],
+                               "max_pos": statistics[f"max_pos_{ch}"],
+                               "n_variants": statistics[f"n_variants_{ch}"]}
+                          for ch in CHR_VALUES if f"n_variants_{ch}" in statistics},
+        "histograms": histograms,
+        "dataset_version": dataset_version
+    }
+
+
+def timeout_error(endpoint: str) -> dict:
+    return {
+        "success": False,
+        "error": "timeout",
+        "reason": "the query took too long to run; try narrowing the search or filters",
+        "statement_timeout": get_statement_timeout(endpoint)
+    }
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.before_request
+def check_etag():
+    if request.method != "GET" or request.endpoint not in CACHEABLE_ENDPOINTS:
+        return None
+
+    if request.args.get("approximate", "false") == "true":
+        # Approximate counts are refined in the background, so they should not be cached.
+        return None
+
+    dataset = (request.view_args or {}).get("dataset")
+    dataset_version = None
+    if dataset is not None:
+        if dataset not in DATASETS:
+            return None
+
+        dataset_version = get_cached_dataset_version(dataset)
+        if dataset_version is None:
+            # Data imported without a version stamp; responses cannot be safely cached.
+            return None
+
+    g.etag = build_etag(dataset_version, request.path, request.args)
+    if request.if_none_match.contains_weak(g.etag):
+        record_cache_request("http", True)
+        return Response(status=304)
+
+    if request.endpoint in RESULT_CACHE_ENDPOINTS:
+        # The ETag already identifies the dataset version and request, so it doubles as the result cache key.
+        cached_result = result_cache.get(g.etag)
+        record_cache_request("result", cached_result is not None)
+        if cached_result is not None:
+            g.result_cache_hit = True
+            return Response(cached_result, mimetype="application/json")
+
+    return None
+
+
+@app.after_request
+def add_cache_headers(response: Response) -> Response:
+    etag = getattr(g, "etag", None)
+    if etag is not None and response.status_code in (200, 304):
+        if (response.status_code == 200 and request.endpoint in RESULT_CACHE_ENDPOINTS and
+                not getattr(g, "result_cache_hit", False) and not response.is_streamed):
+            result_cache.set(etag, response.get_data())
+
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = f"public, max-age={CACHE_MAX_AGE}"
+    return response
+
+
+@app.after_request
+def record_request_duration(response: Response) -> Response:
+    request_start = getattr(g, "request_start", None)
+    if request_start is not None:
+        request_duration.observe(time.perf_counter() - request_start, current_endpoint(), str(response.status_code))
+    metrics_registry.publish()
+    return response
+
+
+@app.errorhandler(psycopg2.errors.QueryCanceled)
+def query_cancelled(_e) -> Response:
+    return Response(status=503, content_type="application/json", headers={"Retry-After": "60"},
+                    response=json.dumps(timeout_error(current_endpoint())))
+
+
 @app.get("/datasets/")
 def datasets() -> Response:
     return json.jsonify(sorted([{"id": k, **v} for k, v in DATASETS.items()], key=lambda x: x["id"]))
@@ -293,45 +1348,27 @@ def datasets() -> Response:
 
 @app.get("/datasets/<string:dataset>/")
 def dataset_index(dataset: str) -> Response:
-    c = get_db(dataset).cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    c.execute(build_variants_query(
-        c,
-        "variants.*, cartoon_text AS cartoon",
-        get_search_params_from_request(c),
-        cartoons=True,
-        sort_by=verify_domain(request.args.get("sort_by", "id"), build_variants_columns_domain(c)),
-        sort_order=verify_domain(request.args.get("sort_order", "ASC").upper(), SORT_ORDER_DOMAIN),
-        page=int(verify_domain(request.args.get("page", "1"), POS_INT_DOMAIN)),
-        items_per_page=int(verify_domain(request.args.get("items_per_page", "100"), POS_INT_DOMAIN))
-    ))
-
-    results = c.fetchall()
-    for r in results:
-        del r["full_row"]
-    return json.jsonify(results)
+    c = get_db(dataset).cursor()
+    query, fields, row_transform = build_dataset_index_query(c, request.args)
+    return listing_response(dataset, c, query, fields, row_transform)
 
 
 @app.get("/datasets/<string:dataset>/tsv")
 def variants_tsv(dataset: str) -> Response:
-    c = get_db(dataset).cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-
-    search_params = get_search_params_from_request(c)
-
-    sort_by = verify_domain(request.args.get("sort_by", "id"), build_variants_columns_domain(c))
-    sort_order = verify_domain(request.args.get("sort_order", "ASC").upper(), SORT_ORDER_DOMAIN)
+    c = get_db(dataset).cursor()
+    query, column_names = build_variants_tsv_query(c, request.args)
 
-    column_names = [i["column_name"] for i in get_variants_columns(c)]
+    statement_timeout = get_statement_timeout(request.endpoint)
 
     def generate():
-        with app.app_context():
-            c2 = get_db(dataset).cursor("variants-tsv-cursor")
-            c2.execute(build_variants_query(c2, ",".join(column_names), search_params, sort_by=sort_by,
-                                            sort_order=sort_order))
+        with streaming_db(dataset, statement_timeout) as conn:
+            c2 = conn.cursor("variants-tsv-cursor")
+            c2.execute(query)
 
             yield "\t".join(column_names) + "\n"
             row = c2.fetchone()
             while row is not None:
-                yield "\t".join([str(col) if col is not None else "NA" for col in row]) + "\n"
+                yield tsv_line(row)
                 row = c2.fetchone()
 
     return Response(generate(), mimetype="text/tab-separated-values",
@@ -340,9 +1377,43 @@ def variants_tsv(dataset: str) -> Response:
 
 @app.get("/datasets/<string:dataset>/variants/<int:variant_id>/guides")
 def variant_guides(dataset: str, variant_id: int):
-    c = get_db(dataset).cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    c.execute("SELECT * FROM guides WHERE variant_id = %s", (variant_id,))
-    return json.jsonify(c.fetchall())
+    c = get_db(dataset).cursor()
+    fields = get_fields([i["column_name"] for i in get_guides_columns(c)], request.args)
+    return listing_response(dataset, c, c.mogrify(f"SELECT {', '.join(fields)} FROM guides WHERE variant_id = %s",
+                                                  (variant_id,)), fields)
+
+
+@app.get("/datasets/<string:dataset>/variants/guides")
+def variants_guides(dataset: str) -> Response:
+    """
+    Returns the guides for a batch of variants (e.g. a page of the variants table) in a single query.
+    :return: A JSON response with an object mapping each variant ID to a list of its guides.
+    """
+
+    c = get_db(dataset).cursor()
+    query, ids, fields = build_variants_guides_query(c, request.args)
+    c.execute(query)
+    return json.jsonify(group_guides_by_variant(ids, fields, c.fetchall()))
+
+
+@app.get("/datasets/<string:dataset>/variants/<int:variant_id>/cartoon")
+def variant_cartoon(dataset: str, variant_id: int) -> Response:
+    c = get_db(dataset).cursor()
+    c.execute("SELECT cartoon_zlib FROM cartoons WHERE variant_id = %s", (variant_id,))
+    cartoon = c.fetchone()
+    return json.jsonify(decompress_cartoon(cartoon[0]) if cartoon is not None else None)
+
+
+@app.get("/datasets/<string:dataset>/cartoons")
+def cartoons(dataset: str) -> Response:
+    """
+    Returns the cartoons for a batch of variants, specified as a comma-separated list of IDs in the ids parameter.
+    :return: A JSON response with an object mapping variant IDs to cartoons; variants without cartoons are omitted.
+    """
+
+    c = get_db(dataset).cursor()
+    c.execute("SELECT variant_id, cartoon_zlib FROM cartoons WHERE variant_id = ANY(%s)", (get_id_list(request.args),))
+    return json.jsonify({v_id: decompress_cartoon(cartoon_zlib) for v_id, cartoon_zlib in c.fetchall()})
 
 
 @app.get("/datasets/<string:dataset>/variants/<int:variant_id>/guides/tsv")
@@ -350,15 +1421,17 @@ def variant_guides_tsv(dataset: str, variant_id: int) -> Response:
     c = get_db(dataset).cursor(cursor_factory=psycopg2.extras.RealDictCursor)
     column_names = [i["column_name"] for i in get_guides_columns(c)]
 
+    statement_timeout = get_statement_timeout(request.endpoint)
+
     def generate():
-        with app.app_context():
-            c2 = get_db(dataset).cursor("variant-guides-tsv-cursor")
+        with streaming_db(dataset, statement_timeout) as conn:
+            c2 = conn.cursor("variant-guides-tsv-cursor")
             c2.execute("SELECT * FROM guides WHERE variant_id = %s", (variant_id,))
 
             yield "\t".join(column_names) + "\n"
             row = c2.fetchone()
             while row is not None:
-                yield "\t".join([str(col) if col is not None else "NA" for col in row]) + "\n"
+                yield tsv_line(row)
                 row = c2.fetchone()
 
     return Response(generate(), mimetype="text/tab-separated-values",
@@ -368,63 +1441,27 @@ def variant_guides_tsv(dataset: str, variant_id: int) -> Response:
 
 @app.get("/datasets/<string:dataset>/guides")
 def guides(dataset: str) -> Response:
-    page = int(verify_domain(request.args.get("page", "1"), POS_INT_DOMAIN))
-    items_per_page = int(verify_domain(request.args.get("items_per_page", "100"), POS_INT_DOMAIN))
-
-    c = get_db(dataset).cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-
-    search_params = get_search_params_from_request(c)
-
-    sort_by = verify_domain(request.args.get("sort_by", "id"), build_variants_columns_domain(c))
-    sort_order = verify_domain(request.args.get("sort_order", "ASC").upper(), SORT_ORDER_DOMAIN)
-
-    # TODO: ALLOW SORTING GUIDES AS WELL?
-
-    query_str = build_variants_query_str(
-        c,
-        "id",
-        search_params,
-
-        sort_by=sort_by,
-        sort_order=sort_order,
-
-        page=page,
-        items_per_page=items_per_page,
-
-        outer_query=False
-    )
-
-    c.execute(f"SELECT * FROM guides WHERE variant_id IN ({query_str}) ORDER BY id")
-    return json.jsonify(c.fetchall())
+    c = get_db(dataset).cursor()
+    query, fields = build_guides_listing_query(c, request.args)
+    return listing_response(dataset, c, query, fields)
 
 
 @app.get("/datasets/<string:dataset>/guides/tsv")
 def guides_tsv(dataset: str) -> Response:
-    c = get_db(dataset).cursor(cursor_factory=psycopg2.extras.DictCursor)
-    search_params = get_search_params_from_request(c)
-    variant_column_names = [i["column_name"] for i in get_variants_columns(c)]
-    column_names = [i["column_name"] for i in get_guides_columns(c)]
+    c = get_db(dataset).cursor()
+    query, column_names = build_guides_tsv_query(c, request.args)
 
-    guides_with_variant_info = request.args.get("guides_with_variant_info", "true").lower() == "true"
+    statement_timeout = get_statement_timeout(request.endpoint)
 
     def generate():
-        with app.app_context():
-            c2 = get_db(dataset).cursor("guides-tsv-cursor")
-
-            if guides_with_variant_info:
-                c2.execute(f"SELECT {', '.join([f'variants.{col}' for col in variant_column_names[1:]])}, "
-                           f"guides.* FROM variants RIGHT JOIN guides ON variants.id = guides.variant_id "
-                           f"WHERE variant_id IN ({build_variants_query_str(c, 'id', search_params)})")
-                yield "\t".join(variant_column_names[1:] + column_names) + "\n"
-
-            else:
-                c2.execute(f"SELECT * FROM guides WHERE variant_id IN "
-                           f"({build_variants_query_str(c, 'id', search_params)})")
-                yield "\t".join(column_names) + "\n"
+        with streaming_db(dataset, statement_timeout) as conn:
+            c2 = conn.cursor("guides-tsv-cursor")
+            c2.execute(query)
 
+            yield "\t".join(column_names) + "\n"
             row = c2.fetchone()
             while row is not None:
-                yield "\t".join([str(col) if col is not None else "NA" for col in row]) + "\n"
+                yield tsv_line(row)
                 row = c2.fetchone()
 
     return Response(generate(), mimetype="text/tab-separated-values",
@@ -433,45 +1470,24 @@ def guides_tsv(dataset: str) -> Response:
 
 @app.get("/datasets/<string:dataset>/combined/tsv")
 def combined_tsv(dataset: str) -> Response:
-    c = get_db(dataset).cursor(cursor_factory=psycopg2.extras.DictCursor)
-
-    search_params = get_search_params_from_request(c)
+    c = get_db(dataset).cursor()
+    query, variants_column_names, guides_column_names = build_combined_tsv_query(c, request.args)
+    guides_with_variant_info = get_guides_with_variant_info(request.args)
 
-    guides_with_variant_info = request.args.get("guides_with_variant_info", "true").lower() == "true"
-
-    sort_by = verify_domain(request.args.get("sort_by", "id"), build_variants_columns_domain(c))
-    sort_order = verify_domain(request.args.get("sort_order", "ASC").upper(), SORT_ORDER_DOMAIN)
-
-    variants_column_names = [i["column_name"] for i in get_variants_columns(c)]
-    guides_column_names = [i["column_name"] for i in get_guides_columns(c)]
+    statement_timeout = get_statement_timeout(request.endpoint)
 
     def generate():
-        with app.app_context():
-            c2 = get_db(dataset).cursor("combined-tsv-cursor")
-            c2.execute(build_variants_query(c, ",".join(variants_column_names), search_params, sort_by, sort_order))
+        with streaming_db(dataset, statement_timeout) as conn:
+            c2 = conn.cursor("combined-tsv-cursor")
+            c2.execute(query)
 
             yield "\t".join(variants_column_names + [col if col != "id" else "guide_id"
                                                      for col in guides_column_names]) + "\n"
-            c3 = get_db(dataset).cursor()
+            c3 = conn.cursor()
             row = c2.fetchone()
             while row is not None:
-                row_to_return = [str(col) if col is not None else "NA" for col in row]
-
-                c3.execute("SELECT * FROM guides WHERE variant_id = %s", (row_to_return[0],))
-                guide_row = c3.fetchone()
-
-                if guide_row is None or not guides_with_variant_info:
-                    # No guides, or displaying guides with variant info is disabled
-                    yield "\t".join(row_to_return) + "\n"
-
-                while guide_row is not None:
-                    guide_info = [str(col) if col is not None else "NA" for col in guide_row]
-                    if guides_with_variant_info:
-                        yield "\t".join(row_to_return + guide_info) + "\n"
-                    else:
-                        yield "\t".join(([""] * len(variants_column_names)) + guide_info) + "\n"
-                    guide_row = c3.fetchone()
-
+                c3.execute("SELECT * FROM guides WHERE variant_id = %s", (row[0],))
+                yield from combined_tsv_lines(row, c3.fetchall(), len(variants_column_names), guides_with_variant_info)
                 row = c2.fetchone()
 
     return Response(generate(), mimetype="text/tab-separated-values",
@@ -479,21 +1495,114 @@ def combined_tsv(dataset: str) -> Response:
                                                     "filename=\"variants_with_guides.tsv\""})
 
 
+@app.get("/datasets/<string:dataset>/compare/<string:other_dataset>")
+def compare_datasets(dataset: str, other_dataset: str) -> Response:
+    """
+    Compares the variants matching the filtering parameters in two datasets, joined by chromosome, position and RS ID,
+    streaming their PAM / guide statistics side by side (as newline-delimited JSON by default, or TSV with format=tsv.)
+    Both datasets are queried concurrently. With differences=true, only variants which are missing from one dataset or
+    whose statistics differ are included.
+    """
+
+    if dataset not in DATASETS or other_dataset not in DATASETS or dataset == other_dataset:
+        raise DomainError
+
+    row_format = verify_domain(request.args.get("format", "ndjson"), COMPARE_FORMAT_DOMAIN)
+    differences_only = verify_domain(request.args.get("differences", "false"), BOOLEAN_DOMAIN) == "true"
+
+    # Parameters are validated (and queries built) against each dataset's columns before the response starts.
+    query = build_compare_query(get_db(dataset).cursor(), request.args)
+    other_query = build_compare_query(get_db(other_dataset).cursor(), request.args)
+
+    statement_timeout = get_statement_timeout(request.endpoint)
+
+    def generate():
+        rows, cancel = fetch_in_background(dataset, query, statement_timeout, "compare-cursor")
+        other_rows, cancel_other = fetch_in_background(other_dataset, other_query, statement_timeout,
+                                                       "compare-other-cursor")
+
+        try:
+            if row_format == "tsv":
+                yield compare_header(dataset, other_dataset)
+
+            for row, other_row in merge_compared_rows(rows, other_rows):
+                if not differences_only or compared_rows_differ(row, other_row):
+                    yield compare_line(dataset, other_dataset, row, other_row, row_format)
+
+        finally:
+            # Cancels any running queries if the client disconnected
+            cancel()
+            cancel_other()
+
+    if row_format == "tsv":
+        return Response(generate(), mimetype="text/tab-separated-values",
+                        headers={"Content-Disposition": f"Content-Disposition: attachment; "
+                                                        f"filename=\"{dataset}_vs_{other_dataset}.tsv\""})
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
 @app.get("/datasets/<string:dataset>/variants/entries")
 def variants_entries(dataset: str) -> Response:
     c = get_db(dataset).cursor(cursor_factory=psycopg2.extras.DictCursor)
-    entries_query = build_variants_query(c, "COUNT(*)", get_search_params_from_request(c), outer_query=False)
-    return json.jsonify(get_entries_with_cache(dataset, c, entries_query))
+    search_params = get_search_params(c, request.args)
+    approximate = verify_domain(request.args.get("approximate", "false"), BOOLEAN_DOMAIN) == "true"
+
+    facet_counts = get_facet_counts(c, search_params)
+    if facet_counts is not None:
+        n_variants, _, remainder_params = facet_counts
+        is_approximate = False
+        if remainder_params is not None:
+            remainder_query = build_variants_query(c, "COUNT(*)", remainder_params, outer_query=False)
+            if approximate:
+                n_remainder, is_approximate = get_approximate_entries_with_cache(
+                    dataset, c, remainder_query, build_variants_query(c, "id", remainder_params, outer_query=False))
+            else:
+                n_remainder = get_entries_with_cache(dataset, c, remainder_query)
+            n_variants += n_remainder
+        return entries_response(n_variants, approximate, is_approximate)
+
+    entries_query = build_variants_query(c, "COUNT(*)", search_params, outer_query=False)
+
+    if approximate:
+        n_variants, is_approximate = get_approximate_entries_with_cache(
+            dataset, c, entries_query, build_variants_query(c, "id", search_params, outer_query=False))
+        return entries_response(n_variants, True, is_approximate)
+
+    return entries_response(get_entries_with_cache(dataset, c, entries_query), False)
 
 
 @app.get("/datasets/<string:dataset>/guides/entries")
 def guides_entries(dataset: str) -> Response:
     c = get_db(dataset).cursor(cursor_factory=psycopg2.extras.DictCursor)
-    entries_query = c.mogrify(
-        f"SELECT COUNT(*) FROM guides WHERE variant_id IN "
-        f"({build_variants_query_str(c, 'id', get_search_params_from_request(c), outer_query=False)})"
-    )
-    return json.jsonify(get_entries_with_cache(dataset, c, entries_query))
+    search_params = get_search_params(c, request.args)
+    guides_search_params = get_guides_search_params(c, request.args)
+    approximate = verify_domain(request.args.get("approximate", "false"), BOOLEAN_DOMAIN) == "true"
+
+    def build_entries_query(params, selection="COUNT(*)"):
+        return build_guides_query(c, selection, params, guides_search_params)
+
+    # Facet counts are only kept for whole variants, so they cannot be used if guides are filtered.
+    facet_counts = (get_facet_counts(c, search_params)
+                    if guides_search_params["guides_search_query_fragment"] == "true" else None)
+    if facet_counts is not None:
+        _, n_guides, remainder_params = facet_counts
+        is_approximate = False
+        if remainder_params is not None:
+            if approximate:
+                n_remainder, is_approximate = get_approximate_entries_with_cache(
+                    dataset, c, build_entries_query(remainder_params), build_entries_query(remainder_params, "id"))
+            else:
+                n_remainder = get_entries_with_cache(dataset, c, build_entries_query(remainder_params))
+            n_guides += n_remainder
+        return entries_response(n_guides, approximate, is_approximate)
+
+    if approximate:
+        n_guides, is_approximate = get_approximate_entries_with_cache(
+            dataset, c, build_entries_query(search_params), build_entries_query(search_params, "id"))
+        return entries_response(n_guides, True, is_approximate)
+
+    return entries_response(get_entries_with_cache(dataset, c, build_entries_query(search_params)), False)
 
 
 @app.get("/datasets/<string:dataset>/variants/fields")
@@ -502,6 +1611,23 @@ def variant_fields(dataset: str) -> Response:
     return json.jsonify({col["column_name"]: col for col in get_variants_columns(c)})
 
 
+@app.get("/datasets/<string:dataset>/guides/fields")
+def guide_fields(dataset: str) -> Response:
+    c = get_db(dataset).cursor(cursor_factory=psycopg2.extras.DictCursor)
+    return json.jsonify({col["column_name"]: col for col in get_guides_columns(c)})
+
+
+@app.get("/datasets/<string:dataset>/genes")
+def gene_suggestions(dataset: str) -> Response:
+    """
+    Returns gene symbols starting with the (case-insensitive) prefix given, for autocompletion of the gene filter.
+    :return: A JSON response with a sorted list of matching gene symbols.
+    """
+
+    c = get_db(dataset).cursor()
+    return json.jsonify(match_gene_symbols(get_gene_symbols(dataset, c), request.args))
+
+
 @app.get("/datasets/<string:dataset>/metadata")
 def metadata(dataset: str) -> Response:
     """
@@ -510,76 +1636,84 @@ def metadata(dataset: str) -> Response:
     :return: A JSON response with metadata and summary statistics.
     """
 
-    c = get_db(dataset).cursor(cursor_factory=psycopg2.extras.DictCursor)
-    c.execute("SELECT (SELECT CAST(s_value AS INTEGER) FROM summary_statistics WHERE s_key = 'min_pos') AS min_pos, "
-              "  (SELECT CAST(s_value AS INTEGER) FROM summary_statistics WHERE s_key = 'max_pos') AS max_pos, "
-              "  MAX(mh_l) AS max_mh_l, MAX(mh_1l) AS max_mh_1l FROM variants")
+    c = get_db(dataset).cursor()
+    dataset_version = get_dataset_version(c)
+
+    metadata_cache_hit = dataset in metadata_cache and metadata_cache[dataset][0] == dataset_version
+    record_cache_request("metadata", metadata_cache_hit)
+
+    if not metadata_cache_hit:
+        c.execute(METADATA_STATISTICS_QUERY)
+        statistics_rows = c.fetchall()
+        c.execute(METADATA_HISTOGRAMS_QUERY)
+        metadata_cache[dataset] = (dataset_version, build_metadata(statistics_rows, c.fetchall(), dataset_version))
+
     return json.jsonify({
-        **dict(c.fetchone()),
+        **metadata_cache[dataset][1],
         "chr": CHR_VALUES,
         "location": LOCATION_VALUES,
         "version": __version__
     })
 
 
+@app.get("/metrics")
+def metrics() -> Response:
+    """
+    Returns request, query and cache metrics, summed over all worker processes, in the Prometheus text exposition
+    format.
+    """
+
+    return Response(metrics_registry.render(), mimetype="text/plain; version=0.0.4")
+
+
 @app.get("/token")
 def email_token() -> Response:
-    token = secrets.token_hex(24)
-    expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
-    email_tokens[token] = expiry
+    """
+    Issues a single-use token for the bug report form, valid for an hour. Tokens are stored in the database so that they
+    are accepted by any worker process.
+    """
+
+    # Also resumes sending any reports left in the outbox (e.g. after a restart) in this worker process
+    bug_report_sender.start()
+
+    db = get_db(BUG_REPORT_DATASET)
+    c = db.cursor()
+    c.execute("DELETE FROM email_tokens WHERE expiry < NOW()")
+    c.execute("INSERT INTO email_tokens VALUES(%s, NOW() + INTERVAL '1 hour') RETURNING token, expiry",
+              (secrets.token_hex(24),))
+    token, expiry = c.fetchone()
+    db.commit()
     return json.jsonify({"token": token, "expiry": int(expiry.timestamp())})
 
 
 @app.post("/report")
 def bug_report() -> Response:
-    data = request.get_json()
-    if "token" not in data:
-        return Response(status=400, content_type="application/json",
-                        response=json.jsonify({"success": False, "reason": "token passed incorrectly"}))
-
-    now = datetime.datetime.now()
-    for token in email_tokens:
-        if email_tokens[token] < now:
-            del email_tokens[token]
-
-    token = data["token"]
-    if token not in email_tokens.keys():
-        return Response(status=400, content_type="application/json",
-                        response=json.jsonify({"success": False, "reason": "invalid token"}))
-
-    c = get_db(BUG_REPORT_DATASET).cursor()
-    c.execute("INSERT INTO bug_reports(email, report) VALUES(%s, %s) RETURNING id", (data["email"], data["text"]))
-    bug_report_id = c.fetchone()[0]
-
-    message = EmailMessage()
-
-    # Email headers
-    message["From"] = "no-reply@mhcut-browser.genap.ca"
-    message["To"] = os.environ.get("BUG_REPORT_EMAIL").strip()
-    message["Subject"] = f"MHcut Bug Report (ID: {bug_report_id})"
-    message["Reply-To"] = data["email"]
-
-    # Email content
-    message.set_content(
-        f"{data['email']} submitted the following bug report:\n"
-        f"--------------------------------------------------------------------------------\n\n"
-        f"{data['text']}"
-    )
+    """
+    Stores a bug report and adds it to the outbox, from which it is emailed in the background; responds without
+    waiting for the email to be sent.
+    """
 
-    try:
-        with smtplib.SMTP("smtp.gmail.com", 587) as smtp:
-            smtp.ehlo()
-            smtp.starttls()
-            smtp.login(os.environ.get("GMAIL_SENDER_EMAIL"), os.environ.get("GMAIL_SENDER_PASSWORD"))
-            smtp.send_message(message)
-            return json.jsonify({"success": True})
-    except ConnectionRefusedError:
-        return json.jsonify({"success": False, "reason": "could not connect to mail server"})
-    except smtplib.SMTPResponseException as e:
-        print(e)
-        return json.jsonify({"success": False, "reason": "smtp error"})
-    finally:
-        del email_tokens[token]
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get("token"), str):
+        return json.jsonify({"success": False, "reason": "token passed incorrectly"}), 400
+
+    # Checked before the token is used up, so that the form can be corrected and re-submitted
+    invalid_reason = validate_bug_report(data)
+    if invalid_reason is not None:
+        return json.jsonify({"success": False, "reason": invalid_reason}), 400
+
+    db = get_db(BUG_REPORT_DATASET)
+    c = db.cursor()
+    c.execute("DELETE FROM email_tokens WHERE token = %s AND expiry >= NOW() RETURNING token", (data["token"],))
+    if c.fetchone() is None:
+        db.rollback()
+        return json.jsonify({"success": False, "reason": "invalid token"}), 400
+
+    enqueue_bug_report(c, data["email"], data["text"])
+    db.commit()
+
+    bug_report_sender.wake()
+    return json.jsonify({"success": True})
 
 
 @app.teardown_appcontext
@@ -589,5 +1723,35 @@ def close_connection(_exception):
         dbs[ds].close()
 
 
+def prewarm_result_cache(items_per_page: int = 100):
+    """
+    Fills the shared result cache with the responses for the default (unfiltered) view of each dataset, which are by
+    far the most requested ones. Failures (e.g. the database being unavailable) are logged and otherwise ignored.
+    """
+
+    with app.test_client() as client:
+        for dataset in DATASETS:
+            for path in (f"/datasets/{dataset}/?page=1&items_per_page={items_per_page}",
+                         f"/datasets/{dataset}/guides?page=1&items_per_page={items_per_page}",
+                         f"/datasets/{dataset}/variants/entries",
+                         f"/datasets/{dataset}/guides/entries",
+                         f"/datasets/{dataset}/metadata"):
+                try:
+                    response = client.get(path)
+                    if response.status_code != 200:
+                        app.logger.warning(f"Could not pre-warm {path}: status {response.status_code}")
+                except Exception as e:
+                    app.logger.warning(f"Could not pre-warm {path}: {e}")
+
+
+def start_prewarm_result_cache():
+    """
+    Pre-warms the result cache in a background thread, so that starting the application (or a worker process) neither
+    waits for nor depends on the database.
+    """
+
+    threading.Thread(target=prewarm_result_cache, daemon=True).start()
+
+
 if __name__ == "__main__":
     app.run()
@@ -0,0 +1,738 @@
+# MHcut browser is a web application for browsing data from the MHcut tool.
+# Copyright (C) 2018-2025  the Canadian Centre for Computational Genomics
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""
+ASGI version of the MHcut browser API, serving the same routes as application.py with non-blocking database access
+through a pool of asynchronous connections per dataset, so that a single process can serve many concurrent page loads
+and exports. Request parameters are validated and queries are built by the same functions as in application.py.
+"""
+
+
+import asyncio
+import contextlib
+import os
+import psycopg
+import psycopg.errors
+import secrets
+import time
+
+from psycopg_pool import AsyncConnectionPool
+from quart import Quart, g, jsonify, request, Response
+from typing import Optional
+
+from application import (
+    __version__,
+
+    DATASETS,
+    BUG_REPORT_DATASET,
+    CHR_VALUES,
+    LOCATION_VALUES,
+    BOOLEAN_DOMAIN,
+    COMPARE_FORMAT_DOMAIN,
+    NDJSON_BATCH_SIZE,
+    CACHE_MAX_AGE,
+    DATASET_VERSION_TTL,
+    CACHEABLE_ENDPOINTS,
+    RESULT_CACHE_ENDPOINTS,
+    TABLE_COLUMNS_QUERY,
+    DATASET_VERSION_QUERY,
+    FACET_BIN_SIZE_QUERY,
+    METADATA_STATISTICS_QUERY,
+    METADATA_HISTOGRAMS_QUERY,
+    GENE_SYMBOLS_QUERY,
+
+    DomainError,
+
+    bug_report_sender,
+    result_cache,
+    metrics_registry,
+    request_duration,
+    dataset_versions_cache,
+    metadata_cache,
+    gene_symbols_cache,
+    table_columns_cache,
+
+    build_combined_tsv_query,
+    build_dataset_index_query,
+    build_etag,
+    build_facet_counts_query,
+    build_guides_listing_query,
+    build_guides_query,
+    build_guides_tsv_query,
+    build_metadata,
+    build_variants_guides_query,
+    build_variants_query,
+    build_variants_tsv_query,
+    build_compare_query,
+    can_use_facet_counts,
+    combined_tsv_lines,
+    compact_json,
+    compare_header,
+    compare_key,
+    compare_line,
+    compared_rows_differ,
+    count_entries_in_background,
+    decompress_cartoon,
+    entries_body,
+    get_conninfo,
+    get_fields,
+    get_guides_columns,
+    get_guides_search_params,
+    get_guides_with_variant_info,
+    get_id_list,
+    get_row_format,
+    get_search_params,
+    get_statement_timeout,
+    get_variants_columns,
+    group_guides_by_variant,
+    match_gene_symbols,
+    ndjson_lines,
+    needs_facet_bin_size,
+    record_cache_request,
+    rows_body,
+    store_table_columns,
+    table_columns_key,
+    timeout_error,
+    tsv_line,
+    verify_domain,
+)
+from bug_reports import INSERT_BUG_REPORT_QUERY, INSERT_OUTBOX_QUERY, validate_bug_report
+
+
+ASYNC_POOL_MIN_SIZE = int(os.environ.get("ASYNC_POOL_MIN_SIZE", "2"))
+ASYNC_POOL_MAX_SIZE = int(os.environ.get("ASYNC_POOL_MAX_SIZE", "20"))
+
+STREAM_BATCH_SIZE = 2000
+
+app = Quart(__name__)
+
+# Connection pools, keyed by dataset
+pools = {}
+
+
+@app.before_serving
+async def open_pools():
+    for dataset in DATASETS:
+        # Client-side cursors are used so that queries can be built with mogrify, as with psycopg2.
+        pools[dataset] = AsyncConnectionPool(get_conninfo(dataset), min_size=ASYNC_POOL_MIN_SIZE,
+                                             max_size=ASYNC_POOL_MAX_SIZE, open=False,
+                                             kwargs={"cursor_factory": psycopg.AsyncClientCursor})
+        await pools[dataset].open()
+
+    # Sends any reports left in the outbox, e.g. from before a restart
+    bug_report_sender.start()
+
+
+@app.after_serving
+async def close_pools():
+    for pool in pools.values():
+        await pool.close()
+
+
+async def load_table_columns(dataset: str, conn):
+    # The shared query builders look up column information synchronously, so it must be cached before they are used.
+    # Column information is keyed by dataset version, which is refreshed here as in get_cached_dataset_version.
+    now = time.monotonic()
+    if dataset not in dataset_versions_cache or now - dataset_versions_cache[dataset][0] > DATASET_VERSION_TTL:
+        dataset_versions_cache[dataset] = (now, await fetch_dataset_version(conn.cursor()))
+    conn.dataset_version = dataset_versions_cache[dataset][1]
+
+    for table in ("variants", "guides"):
+        key = table_columns_key(conn, table)
+        if key not in table_columns_cache:
+            c = await conn.execute(TABLE_COLUMNS_QUERY, (table,))
+            store_table_columns(key, await c.fetchall())
+
+
+@contextlib.asynccontextmanager
+async def get_db(dataset: str, statement_timeout: Optional[int] = None):
+    """
+    Checks out a pooled connection for a dataset. Unless specified, the statement timeout is taken from the current
+    endpoint. The transaction is committed when the connection is returned to the pool.
+    """
+
+    async with pools[dataset].connection() as conn:
+        await conn.execute("SELECT set_config('statement_timeout', %s, false)", (str(
+            statement_timeout if statement_timeout is not None else get_statement_timeout(request.endpoint)),))
+        await load_table_columns(dataset, conn)
+        yield conn
+
+
+@contextlib.asynccontextmanager
+async def streaming_db(dataset: str, statement_timeout: int):
+    """
+    Provides a connection for use in a streaming response generator. If the generator is closed early (i.e. the
+    client disconnected), any running query is cancelled before the connection is returned to the pool.
+    """
+
+    async with get_db(dataset, statement_timeout) as conn:
+        try:
+            yield conn
+        except (asyncio.CancelledError, GeneratorExit):
+            await conn.cancel_safe()
+            raise
+
+
+def tsv_response(generate, filename: str) -> Response:
+    return Response(generate(), mimetype="text/tab-separated-values",
+                    headers={"Content-Disposition": f"Content-Disposition: attachment; filename=\"{filename}\""})
+
+
+async def listing_response(dataset: str, c, query, field_names, row_transform=None) -> Response:
+    """
+    Runs a listing query and returns its rows in the requested format, streaming them for format=ndjson (see
+    listing_response in application.py.)
+    """
+
+    row_format = get_row_format(request.args)
+
+    if row_format == "ndjson":
+        statement_timeout = get_statement_timeout(request.endpoint)
+
+        async def generate():
+            async with streaming_db(dataset, statement_timeout) as conn:
+                async with conn.cursor("ndjson-cursor") as c2:
+                    await c2.execute(query)
+
+                    rows = await c2.fetchmany(NDJSON_BATCH_SIZE)
+                    while len(rows) > 0:
+                        yield ndjson_lines(field_names, rows, row_transform)
+                        rows = await c2.fetchmany(NDJSON_BATCH_SIZE)
+
+        return Response(generate(), mimetype="application/x-ndjson")
+
+    await c.execute(query)
+    results = await c.fetchall()
+    body = rows_body(field_names, [row_transform(r) for r in results] if row_transform else results, row_format)
+    return jsonify(body) if row_format == "objects" else Response(compact_json(body), mimetype="application/json")
+
+
+async def fetch_dataset_version(c):
+    await c.execute(DATASET_VERSION_QUERY)
+    version = await c.fetchone()
+    return version[0] if version is not None else None
+
+
+async def get_cached_dataset_version(dataset: str):
+    now = time.monotonic()
+    if dataset not in dataset_versions_cache or now - dataset_versions_cache[dataset][0] > DATASET_VERSION_TTL:
+        async with get_db(dataset):
+            pass  # Checking out a connection refreshes the dataset version (see load_table_columns.)
+    return dataset_versions_cache[dataset][1]
+
+
+async def get_entries_with_cache(c, query: str):
+    cache_key = query.encode("utf-8")
+
+    await c.execute("SELECT * FROM entries_query_cache WHERE e_query = %s::bytea", (cache_key,))
+    cache_value = await c.fetchone()
+    record_cache_request("entries", cache_value is not None)
+    if cache_value is not None:
+        return cache_value[1]
+
+    await c.execute(query)
+    num_entries = (await c.fetchone())[0]
+    await c.execute("INSERT INTO entries_query_cache VALUES(%s::bytea, %s) ON CONFLICT DO NOTHING ",
+                    (cache_key, num_entries))
+
+    return num_entries
+
+
+async def get_approximate_entries_with_cache(dataset: str, c, query: str, estimate_query: str):
+    """
+    Returns the cached exact number of entries for a count query if available, or otherwise the query planner's
+    estimate (see get_approximate_entries_with_cache in application.py.)
+    :return: A tuple of (number of entries, whether the number is approximate).
+    """
+
+    await c.execute("SELECT * FROM entries_query_cache WHERE e_query = %s::bytea", (query.encode("utf-8"),))
+    cache_value = await c.fetchone()
+    record_cache_request("entries", cache_value is not None)
+    if cache_value is not None:
+        return cache_value[1], False
+
+    # The exact count is computed in a thread, with a synchronous connection of its own.
+    count_entries_in_background(dataset, query.encode("utf-8"))
+
+    await c.execute("EXPLAIN (FORMAT JSON) " + estimate_query)
+    return int((await c.fetchone())[0][0]["Plan"]["Plan Rows"]), True
+
+
+async def get_facet_counts(c, search_params):
+    """
+    Attempts to answer variant and guide entries counts from the pre-computed facet count tables.
+    :return: None if the search cannot be answered from the facet counts; otherwise, a tuple of (variant count, guide
+             count, remainder search parameters or None).
+    """
+
+    if not can_use_facet_counts(search_params):
+        return None
+
+    bin_size = None
+    if needs_facet_bin_size(search_params):
+        await c.execute(FACET_BIN_SIZE_QUERY)
+        bin_size = (await c.fetchone())[0]
+
+    facet_query = build_facet_counts_query(c, search_params, bin_size)
+    if facet_query is None:
+        return None
+
+    await c.execute(facet_query[0])
+    n_variants, n_guides = await c.fetchone()
+    return n_variants, n_guides, facet_query[1]
+
+
+@app.before_request
+async def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.before_request
+async def check_etag():
+    if request.method != "GET" or request.endpoint not in CACHEABLE_ENDPOINTS:
+        return None
+
+    if request.args.get("approximate", "false") == "true":
+        # Approximate counts are refined in the background, so they should not be cached.
+        return None
+
+    dataset = (request.view_args or {}).get("dataset")
+    dataset_version = None
+    if dataset is not None:
+        if dataset not in DATASETS:
+            return None
+
+        dataset_version = await get_cached_dataset_version(dataset)
+        if dataset_version is None:
+            # Data imported without a version stamp; responses cannot be safely cached.
+            return None
+
+    g.etag = build_etag(dataset_version, request.path, request.args)
+    if request.if_none_match.contains_weak(g.etag):
+        record_cache_request("http", True)
+        return Response("", status=304)
+
+    if request.endpoint in RESULT_CACHE_ENDPOINTS:
+        cached_result = await asyncio.to_thread(result_cache.get, g.etag)
+        record_cache_request("result", cached_result is not None)
+        if cached_result is not None:
+            g.result_cache_hit = True
+            return Response(cached_result, mimetype="application/json")
+
+    return None
+
+
+@app.after_request
+async def add_cache_headers(response: Response) -> Response:
+    etag = getattr(g, "etag", None)
+    if etag is not None and response.status_code in (200, 304):
+        # Streamed (NDJSON) listings are not cached.
+        if (response.status_code == 200 and request.endpoint in RESULT_CACHE_ENDPOINTS and
+                not getattr(g, "result_cache_hit", False) and response.mimetype == "application/json"):
+            await asyncio.to_thread(result_cache.set, etag, await response.get_data())
+
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = f"public, max-age={CACHE_MAX_AGE}"
+    return response
+
+
+@app.after_request
+async def record_request_duration(response: Response) -> Response:
+    request_start = getattr(g, "request_start", None)
+    if request_start is not None:
+        request_duration.observe(time.perf_counter() - request_start, request.endpoint or "unknown",
+                                 str(response.status_code))
+    # Publishing writes to SQLite, so it is kept off the event loop.
+    await asyncio.to_thread(metrics_registry.publish)
+    return response
+
+
+@app.errorhandler(psycopg.errors.QueryCanceled)
+async def query_cancelled(_e) -> Response:
+    return Response(compact_json(timeout_error(request.endpoint or "unknown")), status=503,
+                    content_type="application/json", headers={"Retry-After": "60"})
+
+
+@app.get("/datasets/")
+async def datasets() -> Response:
+    return jsonify(sorted([{"id": k, **v} for k, v in DATASETS.items()], key=lambda x: x["id"]))
+
+
+@app.get("/datasets/<string:dataset>/")
+async def dataset_index(dataset: str) -> Response:
+    async with get_db(dataset) as conn:
+        c = conn.cursor()
+        query, fields, row_transform = build_dataset_index_query(c, request.args)
+        return await listing_response(dataset, c, query, fields, row_transform)
+
+
+@app.get("/datasets/<string:dataset>/tsv")
+async def variants_tsv(dataset: str) -> Response:
+    async with get_db(dataset) as conn:
+        query, column_names = build_variants_tsv_query(conn.cursor(), request.args)
+
+    statement_timeout = get_statement_timeout(request.endpoint)
+
+    async def generate():
+        async with streaming_db(dataset, statement_timeout) as conn2:
+            async with conn2.cursor("variants-tsv-cursor") as c2:
+                await c2.execute(query)
+
+                yield "\t".join(column_names) + "\n"
+                rows = await c2.fetchmany(STREAM_BATCH_SIZE)
+                while len(rows) > 0:
+                    yield "".join(tsv_line(row) for row in rows)
+                    rows = await c2.fetchmany(STREAM_BATCH_SIZE)
+
+    return tsv_response(generate, "variants.tsv")
+
+
+@app.get("/datasets/<string:dataset>/variants/<int:variant_id>/guides")
+async def variant_guides(dataset: str, variant_id: int) -> Response:
+    async with get_db(dataset) as conn:
+        c = conn.cursor()
+        fields = get_fields([i["column_name"] for i in get_guides_columns(c)], request.args)
+        return await listing_response(dataset, c, c.mogrify(
+            f"SELECT {', '.join(fields)} FROM guides WHERE variant_id = %s", (variant_id,)), fields)
+
+
+@app.get("/datasets/<string:dataset>/variants/guides")
+async def variants_guides(dataset: str) -> Response:
+    async with get_db(dataset) as conn:
+        c = conn.cursor()
+        query, ids, fields = build_variants_guides_query(c, request.args)
+        await c.execute(query)
+        return jsonify(group_guides_by_variant(ids, fields, await c.fetchall()))
+
+
+@app.get("/datasets/<string:dataset>/variants/<int:variant_id>/cartoon")
+async def variant_cartoon(dataset: str, variant_id: int) -> Response:
+    async with get_db(dataset) as conn:
+        c = await conn.execute("SELECT cartoon_zlib FROM cartoons WHERE variant_id = %s", (variant_id,))
+        cartoon = await c.fetchone()
+    return jsonify(decompress_cartoon(cartoon[0]) if cartoon is not None else None)
+
+
+@app.get("/datasets/<string:dataset>/cartoons")
+async def cartoons(dataset: str) -> Response:
+    ids = get_id_list(request.args)
+    async with get_db(dataset) as conn:
+        c = await conn.execute("SELECT variant_id, cartoon_zlib FROM cartoons WHERE variant_id = ANY(%s)", (ids,))
+        return jsonify({v_id: decompress_cartoon(cartoon_zlib) for v_id, cartoon_zlib in await c.fetchall()})
+
+
+@app.get("/datasets/<string:dataset>/variants/<int:variant_id>/guides/tsv")
+async def variant_guides_tsv(dataset: str, variant_id: int) -> Response:
+    async with get_db(dataset) as conn:
+        column_names = [i["column_name"] for i in get_guides_columns(conn.cursor())]
+
+    statement_timeout = get_statement_timeout(request.endpoint)
+
+    async def generate():
+        async with streaming_db(dataset, statement_timeout) as conn2:
+            c2 = await conn2.execute("SELECT * FROM guides WHERE variant_id = %s", (variant_id,))
+            yield "\t".join(column_names) + "\n"
+            yield "".join(tsv_line(row) for row in await c2.fetchall())
+
+    return tsv_response(generate, f"variant_{variant_id}_guides.tsv")
+
+
+@app.get("/datasets/<string:dataset>/guides")
+async def guides(dataset: str) -> Response:
+    async with get_db(dataset) as conn:
+        c = conn.cursor()
+        query, fields = build_guides_listing_query(c, request.args)
+        return await listing_response(dataset, c, query, fields)
+
+
+@app.get("/datasets/<string:dataset>/guides/tsv")
+async def guides_tsv(dataset: str) -> Response:
+    async with get_db(dataset) as conn:
+        query, column_names = build_guides_tsv_query(conn.cursor(), request.args)
+
+    statement_timeout = get_statement_timeout(request.endpoint)
+
+    async def generate():
+        async with streaming_db(dataset, statement_timeout) as conn2:
+            async with conn2.cursor("guides-tsv-cursor") as c2:
+                await c2.execute(query)
+
+                yield "\t".join(column_names) + "\n"
+                rows = await c2.fetchmany(STREAM_BATCH_SIZE)
+                while len(rows) > 0:
+                    yield "".join(tsv_line(row) for row in rows)
+                    rows = await c2.fetchmany(STREAM_BATCH_SIZE)
+
+    return tsv_response(generate, "guides.tsv")
+
+
+@app.get("/datasets/<string:dataset>/combined/tsv")
+async def combined_tsv(dataset: str) -> Response:
+    async with get_db(dataset) as conn:
+        query, variants_column_names, guides_column_names = build_combined_tsv_query(conn.cursor(), request.args)
+    guides_with_variant_info = get_guides_with_variant_info(request.args)
+
+    statement_timeout = get_statement_timeout(request.endpoint)
+
+    async def generate():
+        async with streaming_db(dataset, statement_timeout) as conn2:
+            async with conn2.cursor("combined-tsv-cursor") as c2:
+                await c2.execute(query)
+
+                yield "\t".join(variants_column_names + [col if col != "id" else "guide_id"
+                                                         for col in guides_column_names]) + "\n"
+                c3 = conn2.cursor()
+                rows = await c2.fetchmany(STREAM_BATCH_SIZE)
+                while len(rows) > 0:
+                    for row in rows:
+                        await c3.execute("SELECT * FROM guides WHERE variant_id = %s", (row[0],))
+                        yield "".join(combined_tsv_lines(row, await c3.fetchall(), len(variants_column_names),
+                                                         guides_with_variant_info))
+                    rows = await c2.fetchmany(STREAM_BATCH_SIZE)
+
+    return tsv_response(generate, "variants_with_guides.tsv")
+
+
+async def prefetched_rows(c):
+    # Fetches the next batch of rows while the current one is being consumed, so that queries on several datasets are
+    # run and read concurrently.
+    next_rows = asyncio.ensure_future(c.fetchmany(STREAM_BATCH_SIZE))
+    try:
+        while True:
+            rows = await next_rows
+            if len(rows) == 0:
+                return
+            next_rows = asyncio.ensure_future(c.fetchmany(STREAM_BATCH_SIZE))
+            for row in rows:
+                yield row
+    finally:
+        next_rows.cancel()
+
+
+async def anext_or_none(rows):
+    try:
+        return await rows.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+@app.get("/datasets/<string:dataset>/compare/<string:other_dataset>")
+async def compare_datasets(dataset: str, other_dataset: str) -> Response:
+    if dataset not in DATASETS or other_dataset not in DATASETS or dataset == other_dataset:
+        raise DomainError
+
+    row_format = verify_domain(request.args.get("format", "ndjson"), COMPARE_FORMAT_DOMAIN)
+    differences_only = verify_domain(request.args.get("differences", "false"), BOOLEAN_DOMAIN) == "true"
+
+    async with get_db(dataset) as conn, get_db(other_dataset) as other_conn:
+        query = build_compare_query(conn.cursor(), request.args)
+        other_query = build_compare_query(other_conn.cursor(), request.args)
+
+    statement_timeout = get_statement_timeout(request.endpoint)
+
+    async def generate():
+        async with streaming_db(dataset, statement_timeout) as conn2, \
+                streaming_db(other_dataset, statement_timeout) as other_conn2:
+            async with conn2.cursor("compare-cursor") as c2, other_conn2.cursor("compare-other-cursor") as other_c2:
+                await asyncio.gather(c2.execute(query), other_c2.execute(other_query))
+                rows, other_rows = prefetched_rows(c2), prefetched_rows(other_c2)
+
+                if row_format == "tsv":
+                    yield compare_header(dataset, other_dataset)
+
+                # Full outer merge-join of the two ordered streams (see merge_compared_rows in application.py.)
+                row, other_row = await asyncio.gather(anext_or_none(rows), anext_or_none(other_rows))
+                while row is not None or other_row is not None:
+                    if other_row is None or (row is not None and compare_key(row) < compare_key(other_row)):
+                        pair = (row, None)
+                        row = await anext_or_none(rows)
+                    elif row is None or compare_key(other_row) < compare_key(row):
+                        pair = (None, other_row)
+                        other_row = await anext_or_none(other_rows)
+                    else:
+                        pair = (row, other_row)
+                        row, other_row = await asyncio.gather(anext_or_none(rows), anext_or_none(other_rows))
+
+                    if not differences_only or compared_rows_differ(*pair):
+                        yield compare_line(dataset, other_dataset, *pair, row_format)
+
+    if row_format == "tsv":
+        return tsv_response(generate, f"{dataset}_vs_{other_dataset}.tsv")
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
+@app.get("/datasets/<string:dataset>/variants/entries")
+async def variants_entries(dataset: str) -> Response:
+    approximate = verify_domain(request.args.get("approximate", "false"), BOOLEAN_DOMAIN) == "true"
+
+    async with get_db(dataset) as conn:
+        c = conn.cursor()
+        search_params = get_search_params(c, request.args)
+
+        facet_counts = await get_facet_counts(c, search_params)
+        if facet_counts is not None:
+            n_variants, _, remainder_params = facet_counts
+            is_approximate = False
+            if remainder_params is not None:
+                remainder_query = build_variants_query(c, "COUNT(*)", remainder_params, outer_query=False)
+                if approximate:
+                    n_remainder, is_approximate = await get_approximate_entries_with_cache(
+                        dataset, c, remainder_query, build_variants_query(c, "id", remainder_params, outer_query=False))
+                else:
+                    n_remainder = await get_entries_with_cache(c, remainder_query)
+                n_variants += n_remainder
+            return jsonify(entries_body(n_variants, approximate, is_approximate))
+
+        entries_query = build_variants_query(c, "COUNT(*)", search_params, outer_query=False)
+
+        if approximate:
+            n_variants, is_approximate = await get_approximate_entries_with_cache(
+                dataset, c, entries_query, build_variants_query(c, "id", search_params, outer_query=False))
+            return jsonify(entries_body(n_variants, True, is_approximate))
+
+        return jsonify(entries_body(await get_entries_with_cache(c, entries_query), False))
+
+
+@app.get("/datasets/<string:dataset>/guides/entries")
+async def guides_entries(dataset: str) -> Response:
+    approximate = verify_domain(request.args.get("approximate", "false"), BOOLEAN_DOMAIN) == "true"
+
+    async with get_db(dataset) as conn:
+        c = conn.cursor()
+        search_params = get_search_params(c, request.args)
+        guides_search_params = get_guides_search_params(c, request.args)
+
+        def build_entries_query(params, selection="COUNT(*)"):
+            return build_guides_query(c, selection, params, guides_search_params)
+
+        # Facet counts are only kept for whole variants, so they cannot be used if guides are filtered.
+        facet_counts = (await get_facet_counts(c, search_params)
+                        if guides_search_params["guides_search_query_fragment"] == "true" else None)
+        if facet_counts is not None:
+            _, n_guides, remainder_params = facet_counts
+            is_approximate = False
+            if remainder_params is not None:
+                if approximate:
+                    n_remainder, is_approximate = await get_approximate_entries_with_cache(
+                        dataset, c, build_entries_query(remainder_params), build_entries_query(remainder_params, "id"))
+                else:
+                    n_remainder = await get_entries_with_cache(c, build_entries_query(remainder_params))
+                n_guides += n_remainder
+            return jsonify(entries_body(n_guides, approximate, is_approximate))
+
+        if approximate:
+            n_guides, is_approximate = await get_approximate_entries_with_cache(
+                dataset, c, build_entries_query(search_params), build_entries_query(search_params, "id"))
+            return jsonify(entries_body(n_guides, True, is_approximate))
+
+        return jsonify(entries_body(await get_entries_with_cache(c, build_entries_query(search_params)), False))
+
+
+@app.get("/datasets/<string:dataset>/variants/fields")
+async def variant_fields(dataset: str) -> Response:
+    async with get_db(dataset) as conn:
+        return jsonify({col["column_name"]: col for col in get_variants_columns(conn.cursor())})
+
+
+@app.get("/datasets/<string:dataset>/guides/fields")
+async def guide_fields(dataset: str) -> Response:
+    async with get_db(dataset) as conn:
+        return jsonify({col["column_name"]: col for col in get_guides_columns(conn.cursor())})
+
+
+@app.get("/datasets/<string:dataset>/genes")
+async def gene_suggestions(dataset: str) -> Response:
+    # Re-loaded when the dataset is re-imported (see get_gene_symbols in application.py.)
+    dataset_version = await get_cached_dataset_version(dataset)
+    if dataset not in gene_symbols_cache or gene_symbols_cache[dataset][0] != dataset_version:
+        async with get_db(dataset) as conn:
+            c = await conn.execute(GENE_SYMBOLS_QUERY)
+            gene_symbols_cache[dataset] = (dataset_version, sorted((r[0].upper(), r[0]) for r in await c.fetchall()))
+
+    return jsonify(match_gene_symbols(gene_symbols_cache[dataset][1], request.args))
+
+
+@app.get("/datasets/<string:dataset>/metadata")
+async def metadata(dataset: str) -> Response:
+    async with get_db(dataset) as conn:
+        c = conn.cursor()
+        dataset_version = await fetch_dataset_version(c)
+
+        metadata_cache_hit = dataset in metadata_cache and metadata_cache[dataset][0] == dataset_version
+        record_cache_request("metadata", metadata_cache_hit)
+
+        if not metadata_cache_hit:
+            await c.execute(METADATA_STATISTICS_QUERY)
+            statistics_rows = await c.fetchall()
+            await c.execute(METADATA_HISTOGRAMS_QUERY)
+            metadata_cache[dataset] = (dataset_version,
+                                       build_metadata(statistics_rows, await c.fetchall(), dataset_version))
+
+    return jsonify({
+        **metadata_cache[dataset][1],
+        "chr": CHR_VALUES,
+        "location": LOCATION_VALUES,
+        "version": __version__
+    })
+
+
+@app.get("/metrics")
+async def metrics() -> Response:
+    return Response(await asyncio.to_thread(metrics_registry.render), mimetype="text/plain; version=0.0.4")
+
+
+@app.get("/token")
+async def email_token() -> Response:
+    async with get_db(BUG_REPORT_DATASET) as conn:
+        c = conn.cursor()
+        await c.execute("DELETE FROM email_tokens WHERE expiry < NOW()")
+        await c.execute("INSERT INTO email_tokens VALUES(%s, NOW() + INTERVAL '1 hour') RETURNING token, expiry",
+                        (secrets.token_hex(24),))
+        token, expiry = await c.fetchone()
+    return jsonify({"token": token, "expiry": int(expiry.timestamp())})
+
+
+@app.post("/report")
+async def bug_report() -> Response:
+    data = await request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get("token"), str):
+        return jsonify({"success": False, "reason": "token passed incorrectly"}), 400
+
+    # Checked before the token is used up (see bug_report in application.py.)
+    invalid_reason = validate_bug_report(data)
+    if invalid_reason is not None:
+        return jsonify({"success": False, "reason": invalid_reason}), 400
+
+    async with get_db(BUG_REPORT_DATASET) as conn:
+        async with conn.transaction():
+            c = conn.cursor()
+            await c.execute("DELETE FROM email_tokens WHERE token = %s AND expiry >= NOW() RETURNING token",
+                            (data["token"],))
+            if await c.fetchone() is None:
+                return jsonify({"success": False, "reason": "invalid token"}), 400
+
+            # Same statements as enqueue_bug_report in bug_reports.py, which is written for synchronous cursors
+            await c.execute(INSERT_BUG_REPORT_QUERY, (data["email"], data["text"]))
+            await c.execute(INSERT_OUTBOX_QUERY, ((await c.fetchone())[0],))
+
+    bug_report_sender.wake()
+    return jsonify({"success": True})
+
+
+if __name__ == "__main__":
+    app.run()
@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+
+
+# MHcut browser is a web application for browsing data from the MHcut tool.
+# Copyright (C) 2018-2025  the Canadian Centre for Computational Genomics
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""
+API load-testing and latency benchmark.
+
+Builds a dataset in the current import format from the bundled variants-subset.tsv / guides-subset.tsv files
+(optionally scaled up with shifted copies of each variant), loads it with tsv_to_postgres.py into a disposable local
+Postgres cluster (or an existing database), then replays a weighted mix of realistic requests against the Flask
+application from several concurrent clients and reports latency percentiles, throughput and bytes/second per request
+type. Results can be saved as JSON and compared with a previous run.
+"""
+
+
+import argparse
+import glob
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+BENCHMARK_DB_NAME = "mhcut_benchmark"
+BENCHMARK_DB_USER = "mhcut_benchmark"
+
+VARIANT_HEADERS = ("chr", "start", "end", "RS", "CAF", "TOPMED", "GENEINFO", "PM", "MC", "AF_EXAC", "AF_TGP",
+                   "ALLELEID", "CLNDN", "CLNSIG", "DBVARID", "GENEINFO.ClinVar", "MC.ClinVar", "citation", "geneloc",
+                   "varL", "flank", "mhScore", "mhL", "mh1L", "hom", "nbMM", "mhMaxCons", "mhDist", "mh1Dist",
+                   "MHseq1", "MHseq2", "pamMot", "pamUniq", "guidesNoNMH", "guidesMinNMH", "GC", "max2cutsDist",
+                   "maxInDelphiFreqMean", "maxInDelphiFreqmESC", "maxInDelphiFreqU2OS", "maxInDelphiFreqHEK293",
+                   "maxInDelphiFreqHCT116", "maxInDelphiFreqK562")
+
+GUIDE_HEADERS = ("chr", "start", "end", "RS", "protospacer", "mm0", "m1Dist1", "m1Dist2", "mhDist1", "mhDist2",
+                 "nbNMH", "largestNMH", "nmhScore", "nmhSize", "nmhVarL", "nmhGC", "nmhSeq", "inDelphiFreqMean",
+                 "inDelphiFreqmESC", "inDelphiFreqU2OS", "inDelphiFreqHEK293", "inDelphiFreqHCT116",
+                 "inDelphiFreqK562")
+
+# Columns renamed since the bundled subsets were generated
+LEGACY_VARIANT_COLUMNS = {"guidesNoNMH": "guidesNoOT", "guidesMinNMH": "guidesMinOT"}
+LEGACY_GUIDE_COLUMNS = {"nbNMH": "nbOffTgt", "largestNMH": "largestOffTgt", "nmhScore": "botScore",
+                        "nmhSize": "botSize", "nmhVarL": "botVarL", "nmhGC": "botGC", "nmhSeq": "botSeq"}
+
+IN_DELPHI_SUFFIXES = ("Mean", "mESC", "U2OS", "HEK293", "HCT116", "K562")
+
+SORTABLE_COLUMNS = ("mh_l", "mh_1l", "var_l", "pam_mot", "gc", "max_indelphi_freq_mean", "pos_start")
+GUIDE_SORTABLE_COLUMNS = ("indelphi_freq_mean", "mm0", "nmh_score")
+
+
+# Dataset generation
+
+def read_tsv(path: str) -> Tuple[List[str], List[List[str]]]:
+    with open(path, "r", newline="") as f:
+        headers = next(f)[:-1].split("\t")
+        return headers, [line.rstrip("\n").split("\t") for line in f]
+
+
+def random_in_delphi_freq(rng: random.Random, available: bool) -> str:
+    return f"{rng.uniform(0, 100):.2f}" if available else "NA"
+
+
+def random_cartoon(rng: random.Random, mh_seq: str) -> str:
+    flank = "".join(rng.choice("ACGT") for _ in range(30))
+    mh = mh_seq.upper() if mh_seq not in ("", "NA") else "ACG"
+    sequence = f"{flank}{mh}{''.join(rng.choice('ACGT') for _ in range(12))}{mh}{flank[::-1]}"
+    mh_line = " " * 30 + "|" * len(mh) + " " * 12 + "|" * len(mh)
+    cuts_line = "".join("^" if rng.random() < 0.05 else " " for _ in range(len(sequence)))
+    return f"{sequence}\n{mh_line}\n{cuts_line}\n"
+
+
+def generate_dataset(out_dir: str, scale: int, seed: int) -> Tuple[Tuple[str, str, str], dict]:
+    """
+    Writes variants, guides and cartoons files in the current import format, based on the bundled subsets. Columns
+    missing from the subsets are synthesized; for scale > 1, copies of each variant (and its guides) are added with
+    positions shifted by a few bases.
+    :return: The paths of the three files, and sample values (genes, positions) for building requests.
+    """
+
+    rng = random.Random(seed)
+
+    v_headers, variants = read_tsv(os.path.join(BASE_DIR, "variants-subset.tsv"))
+    g_headers, guides = read_tsv(os.path.join(BASE_DIR, "guides-subset.tsv"))
+
+    vh = {h: i for i, h in enumerate(v_headers)}
+    gh = {h: i for i, h in enumerate(g_headers)}
+
+    guides_by_variant = {}
+    for guide in guides:
+        guides_by_variant.setdefault(tuple(guide[:4]), []).append(guide)
+
+    variants_path = os.path.join(out_dir, "variants.tsv")
+    guides_path = os.path.join(out_dir, "guides.tsv")
+    cartoons_path = os.path.join(out_dir, "cartoons.tsv")
+
+    samples = {"genes": set(), "positions": []}
+    seen_keys = set()
+
+    with open(variants_path, "w") as vf, open(guides_path, "w") as gf, open(cartoons_path, "w") as cf:
+        vf.write("\t".join(VARIANT_HEADERS) + "\n")
+        gf.write("\t".join(GUIDE_HEADERS) + "\n")
+        cf.write("Cartoons generated for benchmarking\n\n")
+
+        for copy in range(scale):
+            for variant in variants:
+                key = (variant[vh["chr"]], str(int(variant[vh["start"]]) + copy),
+                       str(int(variant[vh["end"]]) + copy), variant[vh["RS"]])
+                if key in seen_keys:
+                    continue
+                seen_keys.add(key)
+
+                pam_mot = variant[vh["pamMot"]]
+                has_guides = pam_mot.isdigit() and int(pam_mot) > 0
+
+                synthesized = {
+                    "flank": str(rng.randint(0, 30)),
+                    "mhScore": str(rng.randint(0, 100)),
+                    "mhMaxCons": str(rng.randint(0, 10)),
+                    "mh1Dist": str(rng.randint(0, 20)),
+                    "GC": f"{rng.random():.2f}",
+                    "max2cutsDist": str(rng.randint(0, 50)) if has_guides else "NA",
+                    **{f"maxInDelphiFreq{s}": random_in_delphi_freq(rng, has_guides) for s in IN_DELPHI_SUFFIXES}
+                }
+
+                vf.write("\t".join(key[i] if i < 4 else
+                                   synthesized[h] if h in synthesized else
+                                   variant[vh[LEGACY_VARIANT_COLUMNS.get(h, h)]]
+                                   for i, h in enumerate(VARIANT_HEADERS)) + "\n")
+
+                for guide in guides_by_variant.get(tuple(variant[:4]), ()):
+                    g_synthesized = {f"inDelphiFreq{s}": random_in_delphi_freq(rng, True) for s in IN_DELPHI_SUFFIXES}
+                    gf.write("\t".join(key[i] if i < 4 else
+                                       g_synthesized[h] if h in g_synthesized else
+                                       guide[gh[LEGACY_GUIDE_COLUMNS.get(h, h)]]
+                                       for i, h in enumerate(GUIDE_HEADERS)) + "\n")
+
+                if rng.random() < 0.9:
+                    cf.write("\t".join((*key, "cartoon")) + "\n")
+                    cf.write(random_cartoon(rng, variant[vh["MHseq1"]]))
+                    cf.write("\n")
+
+                for gene in variant[vh["GENEINFO"]].split("|"):
+                    if ":" in gene:
+                        samples["genes"].add(gene.split(":")[0])
+
+                if copy == 0:
+                    samples["positions"].append((key[0], int(key[1])))
+
+    samples["genes"] = sorted(samples["genes"])
+    return (variants_path, guides_path, cartoons_path), samples
+
+
+# Database set-up
+
+def find_postgres_bin_dir(bin_dir: Optional[str]) -> str:
+    if bin_dir is not None:
+        return bin_dir
+
+    pg_ctl = shutil.which("pg_ctl")
+    if pg_ctl is not None:
+        return os.path.dirname(pg_ctl)
+
+    # Debian / Ubuntu packages do not put the server binaries on the PATH
+    candidates = sorted(glob.glob("/usr/lib/postgresql/*/bin/pg_ctl"))
+    if len(candidates) > 0:
+        return os.path.dirname(candidates[-1])
+
+    print("Could not find the Postgres server binaries; specify them with --postgres-bin or use --db-name.")
+    exit(1)
+
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_postgres(bin_dir: str, work_dir: str) -> Callable[[], None]:
+    """
+    Starts a disposable Postgres cluster (listening only on a Unix socket in work_dir), and points libpq at it through
+    the environment.
+    :return: A function which stops the cluster.
+    """
+
+    data_dir = os.path.join(work_dir, "pgdata")
+    port = get_free_port()
+
+    subprocess.run([os.path.join(bin_dir, "initdb"), "-D", data_dir, "-U", BENCHMARK_DB_USER, "-A", "trust",
+                    "--no-sync"], check=True, stdout=subprocess.DEVNULL)
+    subprocess.run([os.path.join(bin_dir, "pg_ctl"), "-D", data_dir, "-l", os.path.join(work_dir, "postgres.log"),
+                    "-o", f"-p {port} -k {work_dir} -c listen_addresses='' -c fsync=off", "-w", "start"],
+                   check=True, stdout=subprocess.DEVNULL)
+
+    os.environ["PGHOST"] = work_dir
+    os.environ["PGPORT"] = str(port)
+
+    def stop():
+        subprocess.run([os.path.join(bin_dir, "pg_ctl"), "-D", data_dir, "-m", "fast", "-w", "stop"],
+                       stdout=subprocess.DEVNULL)
+
+    return stop
+
+
+def create_database(db_name: str, db_user: str):
+    import psycopg2
+
+    conn = psycopg2.connect(f"dbname=postgres user={db_user}")
+    conn.autocommit = True
+    with conn.cursor() as c:
+        c.execute(f"CREATE DATABASE {db_name}")
+    conn.close()
+
+    conn = psycopg2.connect(f"dbname={db_name} user={db_user}")
+    with conn.cursor() as c:
+        c.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    conn.commit()
+    conn.close()
+
+
+def load_dataset(paths: Tuple[str, str, str], db_name: str, db_user: str):
+    subprocess.run([sys.executable, os.path.join(BASE_DIR, "tsv_to_postgres.py"), *paths, db_name, db_user],
+                   check=True, cwd=BASE_DIR)
+
+
+# Request mix
+
+def search_condition(field: str, operator: str, value) -> str:
+    return json.dumps([{"id": 0, "field": field, "operator": operator, "value": value, "negated": False,
+                        "boolean": "AND"}])
+
+
+def build_request_mix(dataset: str, samples: dict) -> List[Tuple[str, int, Callable[[random.Random], str]]]:
+    """
+    :return: A list of (request type, weight, function building a request path from a random generator.)
+    """
+
+    base = f"/datasets/{dataset}"
+
+    def q(path: str, **params) -> str:
+        return f"{path}?{urllib.parse.urlencode(params)}" if len(params) > 0 else path
+
+    def region(rng: random.Random) -> dict:
+        chromosome, position = rng.choice(samples["positions"])
+        return {"chr": chromosome, "start": max(position - 2500000, 0), "end": position + 2500000}
+
+    genes = samples["genes"] or ["BRCA2"]
+
+    return [
+        ("default_view", 25, lambda rng: q(f"{base}/", page=1, items_per_page=100)),
+        ("default_guides", 15, lambda rng: q(f"{base}/guides", page=1, items_per_page=100)),
+        ("deep_page", 8, lambda rng: q(f"{base}/", page=rng.randint(20, 80), items_per_page=100)),
+        ("sorted_page", 6, lambda rng: q(f"{base}/", page=1, items_per_page=100,
+                                         sort_by=rng.choice(SORTABLE_COLUMNS), sort_order=rng.choice(("ASC", "DESC")))),
+        ("region_filter", 8, lambda rng: q(f"{base}/", page=1, items_per_page=100, **region(rng))),
+        ("json_search", 6, lambda rng: q(f"{base}/", page=1, items_per_page=100, search_query=search_condition(
+            "gene_info", "contains", rng.choice(genes)[:3]))),
+        ("gene_filter", 5, lambda rng: q(f"{base}/", page=1, items_per_page=100, gene=rng.choice(genes))),
+        ("compact_page", 3, lambda rng: q(f"{base}/", page=1, items_per_page=1000, format="rows")),
+        ("ranked_guides", 3, lambda rng: q(f"{base}/guides", page=1, items_per_page=100,
+                                           guides_sort_by=rng.choice(GUIDE_SORTABLE_COLUMNS),
+                                           guides_sort_order="DESC")),
+        ("variants_count", 8, lambda rng: q(f"{base}/variants/entries")),
+        ("variants_count_filtered", 5, lambda rng: q(f"{base}/variants/entries", min_mh_1l=rng.randint(3, 8),
+                                                     **region(rng))),
+        ("variants_count_search", 3, lambda rng: q(f"{base}/variants/entries", search_query=search_condition(
+            "mh_l", ">=", rng.randint(5, 15)))),
+        ("guides_count", 5, lambda rng: q(f"{base}/guides/entries", ngg_pam_avail="true")),
+        ("metadata", 5, lambda rng: q(f"{base}/metadata")),
+        ("fields", 3, lambda rng: q(f"{base}/variants/fields")),
+        ("variants_tsv", 2, lambda rng: q(f"{base}/tsv", **region(rng))),
+        ("guides_tsv", 1, lambda rng: q(f"{base}/guides/tsv", **region(rng))),
+        ("combined_tsv", 1, lambda rng: q(f"{base}/combined/tsv", **region(rng))),
+    ]
+
+
+# Benchmark
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if len(sorted_values) == 0:
+        return float("nan")
+    # Nearest-rank method
+    return sorted_values[max(math.ceil(p * len(sorted_values) / 100) - 1, 0)]
+
+
+def run_benchmark(app, mix, n_requests: int, concurrency: int, seed: int) -> Tuple[Dict[str, list], float]:
+    """
+    Replays n_requests requests drawn from the weighted mix, from concurrent clients.
+    :return: (status code, seconds, bytes) samples by request type, and the total wall time of the run.
+    """
+
+    rng = random.Random(seed)
+    schedule = rng.choices(mix, weights=[w for _, w, _ in mix], k=n_requests)
+    requests = [(name, build(rng)) for name, _, build in schedule]
+
+    samples = {name: [] for name, _, _ in mix}
+    samples_lock = threading.Lock()
+    next_request = iter(requests)
+    next_request_lock = threading.Lock()
+
+    def client_worker():
+        with app.test_client() as client:
+            while True:
+                with next_request_lock:
+                    name, path = next(next_request, (None, None))
+                if name is None:
+                    return
+
+                start = time.perf_counter()
+                response = client.get(path)
+                n_bytes = len(response.get_data())  # Consumes streamed responses completely
+                duration = time.perf_counter() - start
+
+                with samples_lock:
+                    samples[name].append((response.status_code, duration, n_bytes))
+
+    workers = [threading.Thread(target=client_worker) for _ in range(concurrency)]
+    run_start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+    return samples, time.perf_counter() - run_start
+
+
+def summarize(samples: Dict[str, list], wall_time: float) -> Dict[str, dict]:
+    summary = {}
+    for name, request_samples in samples.items():
+        if len(request_samples) == 0:
+            continue
+
+        latencies = sorted(d for _, d, _ in request_samples)
+        total_bytes = sum(b for _, _, b in request_samples)
+
+        summary[name] = {
+            "requests": len(request_samples),
+            "errors": sum(1 for s, _, _ in request_samples if s >= 400),
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "mean_ms": sum(latencies) / len(latencies) * 1000,
+            "requests_per_s": len(request_samples) / wall_time,
+            "bytes_per_s": total_bytes / wall_time,
+            "mean_bytes": total_bytes / len(request_samples)
+        }
+
+    return summary
+
+
+def print_report(summary: Dict[str, dict], wall_time: float, previous: Optional[dict] = None):
+    def delta(name: str, key: str) -> str:
+        if previous is None or name not in previous["endpoints"]:
+            return ""
+        old = previous["endpoints"][name][key]
+        return f" ({(summary[name][key] - old) / old * 100:+.0f}%)" if old else ""
+
+    print()
+    print(f"{'request type':<26}{'n':>6}{'err':>5}{'p50 ms':>16}{'p95 ms':>16}{'p99 ms':>16}{'req/s':>9}"
+          f"{'KB/s':>11}")
+    for name, s in summary.items():
+        print(f"{name:<26}{s['requests']:>6}{s['errors']:>5}"
+              f"{s['p50_ms']:>9.1f}{delta(name, 'p50_ms'):>7}"
+              f"{s['p95_ms']:>9.1f}{delta(name, 'p95_ms'):>7}"
+              f"{s['p99_ms']:>9.1f}{delta(name, 'p99_ms'):>7}"
+              f"{s['requests_per_s']:>9.2f}{s['bytes_per_s'] / 1024:>11.1f}")
+
+    n_requests = sum(s["requests"] for s in summary.values())
+    print()
+    print(f"{n_requests} requests in {wall_time:.2f}s ({n_requests / wall_time:.2f} requests/s overall)")
+
+
+def main():
+    """
+    Main method, runs when the script is run directly.
+    """
+
+    parser = argparse.ArgumentParser(description="Load-test the MHcut browser API against a local Postgres database.")
+    parser.add_argument("--scale", type=int, default=1,
+                        help="Number of (position-shifted) copies of the bundled subset to load (default: 1)")
+    parser.add_argument("--requests", type=int, default=500, help="Number of requests to replay (default: 500)")
+    parser.add_argument("--concurrency", type=int, default=5,
+                        help="Number of concurrent clients (default: 5, the number of uWSGI processes)")
+    parser.add_argument("--warm-up", type=int, default=50, help="Number of un-measured warm-up requests (default: 50)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for data and requests (default: 1)")
+    parser.add_argument("--result-cache", action="store_true",
+                        help="Enable the shared result cache (disabled by default, to measure database work)")
+    parser.add_argument("--postgres-bin", help="Directory containing the Postgres server binaries (initdb, pg_ctl)")
+    parser.add_argument("--db-name", help="Use an existing database (which will be overwritten!) instead of a "
+                                          "disposable cluster; connection details are taken from PG* variables")
+    parser.add_argument("--db-user", default=BENCHMARK_DB_USER, help="Database user, with --db-name")
+    parser.add_argument("--skip-load", action="store_true", help="With --db-name, do not (re-)import any data")
+    parser.add_argument("--output", help="Save results as JSON to this path")
+    parser.add_argument("--compare", help="Compare results with a previous run saved with --output")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="mhcut-benchmark-")
+    stop_postgres = None
+
+    try:
+        print("Generating dataset...")
+        paths, samples = generate_dataset(work_dir, args.scale, args.seed)
+
+        db_name, db_user = args.db_name, args.db_user
+        if db_name is None:
+            print("Starting disposable Postgres cluster...")
+            stop_postgres = start_postgres(find_postgres_bin_dir(args.postgres_bin), work_dir)
+            db_name = BENCHMARK_DB_NAME
+            create_database(db_name, db_user)
+
+        os.environ.setdefault("DB_PASSWORD", "benchmark")  # Ignored by the disposable cluster's trust authentication
+
+        if not args.skip_load:
+            load_dataset(paths, db_name, db_user)
+
+        # The application reads its configuration from the environment when imported.
+        os.environ["DB_NAME_CAS"] = db_name
+        os.environ["DB_NAME_XCAS"] = db_name
+        os.environ["DB_USER"] = db_user
+        os.environ["RESULT_CACHE_PATH"] = os.path.join(work_dir, "result_cache.sqlite3")
+        if not args.result_cache:
+            os.environ["RESULT_CACHE_MAX_BYTES"] = "0"
+
+        sys.path.insert(0, BASE_DIR)
+        from application import app
+
+        mix = build_request_mix("cas", samples)
+
+        if args.warm_up > 0:
+            print(f"Warming up ({args.warm_up} requests)...")
+            run_benchmark(app, mix, args.warm_up, args.concurrency, args.seed + 1)
+
+        print(f"Running benchmark ({args.requests} requests, {args.concurrency} concurrent clients)...")
+        samples, wall_time = run_benchmark(app, mix, args.requests, args.concurrency, args.seed)
+        summary = summarize(samples, wall_time)
+
+        previous = None
+        if args.compare is not None:
+            with open(args.compare, "r") as f:
+                previous = json.load(f)
+
+        print_report(summary, wall_time, previous)
+
+        if args.output is not None:
+            with open(args.output, "w") as f:
+                json.dump({
+                    "parameters": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+                    "wall_time_s": wall_time,
+                    "endpoints": summary
+                }, f, indent=2)
+
+    finally:
+        if stop_postgres is not None:
+            stop_postgres()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# MHcut browser is a web application for browsing data from the MHcut tool.
+# Copyright (C) 2018-2025  the Canadian Centre for Computational Genomics
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import re
+import smtplib
+import threading
+
+from email.message import EmailMessage
+from typing import Optional
+
+
+SENDER_ADDRESS = "no-reply@mhcut-browser.genap.ca"
+
+POLL_INTERVAL = 60  # Seconds between checks for reports due to be (re-)sent
+RETRY_BASE_DELAY = 60  # Seconds before the first retry; doubled for each failed attempt
+RETRY_MAX_DELAY = 6 * 60 * 60
+MAX_ATTEMPTS = 10  # Reports are kept in the outbox, but no longer retried, after this many failed attempts
+
+MAX_EMAIL_LENGTH = 254
+MAX_TEXT_LENGTH = 20000
+# A single address, without whitespace (in particular line breaks, which would allow header injection)
+EMAIL_PATTERN = re.compile(r"^[^@\s]+@[^@\s]+$")
+
+CLAIM_QUERY = ("SELECT o.bug_report_id, o.attempts, b.email, b.report "
+               "FROM bug_report_outbox AS o JOIN bug_reports AS b ON b.id = o.bug_report_id "
+               "WHERE o.next_attempt <= NOW() AND o.attempts < %s "
+               "ORDER BY o.next_attempt LIMIT 1 FOR UPDATE OF o SKIP LOCKED")
+INSERT_BUG_REPORT_QUERY = "INSERT INTO bug_reports(email, report) VALUES(%s, %s) RETURNING id"
+INSERT_OUTBOX_QUERY = "INSERT INTO bug_report_outbox(bug_report_id) VALUES(%s)"
+
+
+def get_smtp_settings() -> dict:
+    # Read when sending rather than on import, since wsgi.py sets the environment after importing the application.
+    return {
+        "host": os.environ.get("SMTP_HOST", "smtp.gmail.com"),
+        "port": int(os.environ.get("SMTP_PORT", "587")),
+        "starttls": os.environ.get("SMTP_STARTTLS", "true").lower() == "true",
+        "user": os.environ.get("GMAIL_SENDER_EMAIL"),
+        "password": os.environ.get("GMAIL_SENDER_PASSWORD"),
+    }
+
+
+def build_message(bug_report_id: int, email: str, text: str) -> EmailMessage:
+    message = EmailMessage()
+
+    # Email headers
+    message["From"] = SENDER_ADDRESS
+    message["To"] = os.environ.get("BUG_REPORT_EMAIL").strip()
+    message["Subject"] = f"MHcut Bug Report (ID: {bug_report_id})"
+    message["Reply-To"] = email
+
+    # Email content
+    message.set_content(
+        f"{email} submitted the following bug report:\n"
+        f"--------------------------------------------------------------------------------\n\n"
+        f"{text}"
+    )
+
+    return message
+
+
+def send_message(message: EmailMessage):
+    settings = get_smtp_settings()
+    with smtplib.SMTP(settings["host"], settings["port"], timeout=30) as smtp:
+        smtp.ehlo()
+        if settings["starttls"]:
+            smtp.starttls()
+        if settings["user"]:
+            smtp.login(settings["user"], settings["password"])
+        smtp.send_message(message)
+
+
+def validate_bug_report(data) -> Optional[str]:
+    """
+    Checks the user-supplied fields of a bug report submission.
+    :return: The reason the submission is invalid, or None if it is valid.
+    """
+
+    email = data.get("email")
+    if not isinstance(email, str) or len(email) > MAX_EMAIL_LENGTH or not EMAIL_PATTERN.match(email):
+        return "invalid email"
+
+    text = data.get("text")
+    if not isinstance(text, str) or not text.strip() or len(text) > MAX_TEXT_LENGTH:
+        return "invalid text"
+
+    return None
+
+
+def enqueue_bug_report(c, email: str, text: str) -> int:
+    """
+    Stores a bug report and adds it to the outbox, using the caller's transaction.
+    :return: The ID of the new bug report.
+    """
+
+    c.execute(INSERT_BUG_REPORT_QUERY, (email, text))
+    bug_report_id = c.fetchone()[0]
+    c.execute(INSERT_OUTBOX_QUERY, (bug_report_id,))
+    return bug_report_id
+
+
+class BugReportSender:
+    """
+    Background sender draining the bug report outbox table. Each report is claimed in its own transaction with
+    FOR UPDATE SKIP LOCKED, so senders in any number of worker processes can run at once without sending a report
+    twice; failed attempts are retried with exponential back-off.
+    """
+
+    def __init__(self, connect):
+        self.connect = connect  # Returns a new database connection for the bug report dataset
+        self._wake = threading.Event()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        # Threads do not survive forking into worker processes, so one is started lazily per process.
+        with self._lock:
+            if self._pid == os.getpid() or not os.environ.get("BUG_REPORT_EMAIL"):
+                return
+            self._pid = os.getpid()
+            self._wake = threading.Event()
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def wake(self):
+        self.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                self.send_pending()
+            except Exception as e:
+                print(e)
+            self._wake.wait(POLL_INTERVAL)
+
+    def send_pending(self) -> int:
+        """
+        Sends all reports in the outbox which are due, one at a time.
+        :return: The number of reports sent.
+        """
+
+        n_sent = 0
+        conn = self.connect()
+        try:
+            while True:
+                c = conn.cursor()
+                c.execute(CLAIM_QUERY, (MAX_ATTEMPTS,))
+                claimed = c.fetchone()
+                if claimed is None:
+                    conn.commit()
+                    return n_sent
+
+                bug_report_id, attempts, email, text = claimed
+                try:
+                    send_message(build_message(bug_report_id, email, text))
+                    c.execute("DELETE FROM bug_report_outbox WHERE bug_report_id = %s", (bug_report_id,))
+                    n_sent += 1
+                except Exception as e:
+                    # Any failure (not only SMTP errors) is recorded, so that one report cannot block the outbox.
+                    print(f"Could not send bug report {bug_report_id} (attempt {attempts + 1}): {e}")
+                    c.execute("UPDATE bug_report_outbox SET attempts = attempts + 1, last_error = %s, "
+                              "next_attempt = NOW() + make_interval(secs => %s) WHERE bug_report_id = %s",
+                              (str(e), min(RETRY_BASE_DELAY * 2 ** attempts, RETRY_MAX_DELAY), bug_report_id))
+                conn.commit()
+        finally:
+            conn.close()
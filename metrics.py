@@ -0,0 +1,232 @@
+# MHcut browser is a web application for browsing data from the MHcut tool.
+# Copyright (C) 2018-2025  the Canadian Centre for Computational Genomics
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import hashlib
+import json
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+
+from typing import Dict, Optional, Tuple
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+QUERY_LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+QUERY_WHITESPACE_PATTERN = re.compile(r"\s+")
+QUERY_LIST_PATTERN = re.compile(r"\(\?(?:::\w+)?(?:\s*,\s*\?(?:::\w+)?)*\)")
+
+
+def normalize_query(query) -> str:
+    """
+    Normalizes an SQL query into its "shape", replacing literals (and lists of literals) with placeholders so that
+    queries differing only in their parameter values are grouped together.
+    """
+
+    if isinstance(query, bytes):
+        query = query.decode("utf-8")
+    query = QUERY_LITERAL_PATTERN.sub("?", query)
+    query = QUERY_LIST_PATTERN.sub("(?)", query)
+    return QUERY_WHITESPACE_PATTERN.sub(" ", query).strip()
+
+
+def query_shape_id(normalized_query: str) -> str:
+    return hashlib.sha1(normalized_query.encode("utf-8")).hexdigest()[:12]
+
+
+def _format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...]) -> str:
+    if len(label_names) == 0:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for v in label_values)
+    return "{" + ",".join(f"{n}=\"{v}\"" for n, v in zip(label_names, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(lv), v] for lv, v in self._values.items()]
+
+    def merge(self, snapshots) -> Dict[Tuple[str, ...], float]:
+        values = {}
+        for snapshot in snapshots:
+            for lv, v in snapshot:
+                values[tuple(lv)] = values.get(tuple(lv), 0) + v
+        return values
+
+    def render(self, values: Optional[Dict[Tuple[str, ...], float]] = None) -> str:
+        if values is None:
+            with self._lock:
+                values = dict(self._values)
+        return "".join((f"# HELP {self.name} {self.help_text}\n", f"# TYPE {self.name} counter\n",
+                        *(f"{self.name}{_format_labels(self.label_names, lv)} {v}\n" for lv, v in values.items())))
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._values: Dict[Tuple[str, ...], list] = {}  # Label values: [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            if label_values not in self._values:
+                self._values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            h = self._values[label_values]
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    h[0][i] += 1
+            h[1] += value
+            h[2] += 1
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(lv), list(h[0]), h[1], h[2]] for lv, h in self._values.items()]
+
+    def merge(self, snapshots) -> Dict[Tuple[str, ...], tuple]:
+        values = {}
+        for snapshot in snapshots:
+            for lv, bucket_counts, total, count in snapshot:
+                lv = tuple(lv)
+                if lv not in values:
+                    values[lv] = ([0] * len(self.buckets), 0.0, 0)
+                merged = values[lv]
+                values[lv] = ([a + b for a, b in zip(merged[0], bucket_counts)], merged[1] + total, merged[2] + count)
+        return values
+
+    def render(self, values: Optional[Dict[Tuple[str, ...], tuple]] = None) -> str:
+        if values is None:
+            with self._lock:
+                values = {lv: (list(h[0]), h[1], h[2]) for lv, h in self._values.items()}
+
+        lines = [f"# HELP {self.name} {self.help_text}\n", f"# TYPE {self.name} histogram\n"]
+        for lv, (bucket_counts, total, count) in values.items():
+            for b, bc in zip(self.buckets, bucket_counts):
+                lines.append(f"{self.name}_bucket{_format_labels((*self.label_names, 'le'), (*lv, str(b)))} {bc}\n")
+            lines.append(f"{self.name}_bucket{_format_labels((*self.label_names, 'le'), (*lv, '+Inf'))} {count}\n")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, lv)} {total}\n")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, lv)} {count}\n")
+        return "".join(lines)
+
+
+class SharedSnapshots:
+    """
+    Latest metric snapshots of each application worker process, stored in an SQLite file so that metrics can be
+    aggregated across workers. Snapshots of processes which have not published for max_age seconds (i.e. which have
+    exited) are removed. Errors (e.g. a locked database) are printed and otherwise ignored.
+    """
+
+    def __init__(self, path: str, max_age: float = 24 * 60 * 60):
+        self.path = path
+        self.max_age = max_age
+        self._connections = {}
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections cannot be shared across forked worker processes, so one is opened lazily per process.
+        pid = os.getpid()
+        if pid not in self._connections:
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS snapshots ("
+                         "  process_key TEXT PRIMARY KEY,"
+                         "  s_data TEXT NOT NULL,"
+                         "  updated REAL NOT NULL)")
+            self._connections = {pid: conn}
+        return self._connections[pid]
+
+    def publish(self, process_key: str, data: str):
+        try:
+            conn = self._connection()
+            now = time.time()
+            conn.execute("INSERT OR REPLACE INTO snapshots VALUES(?, ?, ?)", (process_key, data, now))
+            conn.execute("DELETE FROM snapshots WHERE updated < ?", (now - self.max_age,))
+        except sqlite3.Error as e:
+            print(e)
+
+    def load(self) -> list:
+        try:
+            return [json.loads(r[0]) for r in self._connection().execute("SELECT s_data FROM snapshots")]
+        except sqlite3.Error as e:
+            print(e)
+            return []
+
+
+class Registry:
+    """
+    Set of metrics rendered together. If a shared snapshots path is given, each process periodically publishes its
+    metrics there (see publish), and rendering sums the metrics of all processes.
+    """
+
+    def __init__(self, shared_path: Optional[str] = None, publish_interval: float = 5):
+        self.metrics = []
+        self.shared = SharedSnapshots(shared_path) if shared_path else None
+        self.publish_interval = publish_interval
+        self._last_published = 0.0
+        self._process_key = None
+        self._pid = None
+
+        # Forked worker processes publish their own metrics, so they must not start with those of their parent.
+        os.register_at_fork(after_in_child=self._clear)
+
+    def _clear(self):
+        for metric in self.metrics:
+            metric._values.clear()
+            metric._lock = threading.Lock()  # May have been held by another thread at the time of the fork
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def publish(self, force: bool = False):
+        if self.shared is None:
+            return
+
+        pid = os.getpid()
+        now = time.monotonic()
+        if pid != self._pid:
+            # A random suffix keeps snapshots distinct if PIDs are re-used.
+            self._pid = pid
+            self._process_key = f"{pid}-{secrets.token_hex(4)}"
+        elif not force and now - self._last_published < self.publish_interval:
+            return
+
+        self._last_published = now
+        self.shared.publish(self._process_key, json.dumps({m.name: m.snapshot() for m in self.metrics}))
+
+    def render(self) -> str:
+        if self.shared is None:
+            return "".join(m.render() for m in self.metrics)
+
+        self.publish(force=True)
+        snapshots = self.shared.load()
+        return "".join(m.render(m.merge(s.get(m.name, []) for s in snapshots)) for m in self.metrics)
@@ -0,0 +1,116 @@
+# MHcut browser is a web application for browsing data from the MHcut tool.
+# Copyright (C) 2018-2025  the Canadian Centre for Computational Genomics
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import sqlite3
+import threading
+import time
+
+from typing import Optional
+
+
+# Seconds within which repeated hits on a result do not update its last use time, to limit writes under load
+LAST_USED_RESOLUTION = 60
+
+
+class ResultCache:
+    """
+    Size-limited, least-recently-used cache of serialized responses, backed by an SQLite file so that it is shared by
+    all application worker processes. Cache errors (e.g. a locked database) are treated as misses rather than failures.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections cannot be shared across forked worker processes, nor by threads using transactions at the same
+        # time (e.g. the ASGI application's executor threads), so one is opened lazily per process and thread.
+        pid = os.getpid()
+        if getattr(self._local, "pid", None) != pid:
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS results ("
+                         "  r_key TEXT PRIMARY KEY,"
+                         "  r_value BLOB NOT NULL,"
+                         "  r_size INTEGER NOT NULL,"
+                         "  last_used REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS results_last_used_idx ON results(last_used)")
+            # Running total of r_size, kept up to date in the same transactions as the results table
+            conn.execute("CREATE TABLE IF NOT EXISTS results_size ("
+                         "  id INTEGER PRIMARY KEY CHECK (id = 0),"
+                         "  total INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO results_size SELECT 0, COALESCE(SUM(r_size), 0) FROM results")
+            self._local.pid, self._local.conn = pid, conn
+        return self._local.conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            conn = self._connection()
+            row = conn.execute("SELECT r_value, last_used FROM results WHERE r_key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            print(e)
+            return None
+
+        if row is None:
+            return None
+
+        now = time.time()
+        if now - row[1] > LAST_USED_RESOLUTION:
+            try:
+                # Best-effort: under load, this write is the statement most likely to find the database locked, and
+                # the value which has already been read should still be used.
+                conn.execute("UPDATE results SET last_used = ? WHERE r_key = ?", (now, key))
+            except sqlite3.Error as e:
+                print(e)
+
+        return row[0]
+
+    def set(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+
+        conn = None
+        try:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+
+            old_size = conn.execute("SELECT r_size FROM results WHERE r_key = ?", (key,)).fetchone()
+            conn.execute("INSERT OR REPLACE INTO results VALUES(?, ?, ?, ?)", (key, value, len(value), time.time()))
+            conn.execute("UPDATE results_size SET total = total + ?",
+                         (len(value) - (old_size[0] if old_size is not None else 0),))
+            total_size = conn.execute("SELECT total FROM results_size").fetchone()[0]
+
+            if total_size > self.max_bytes:
+                # Evict least-recently-used results until the cache fits within its size limit again.
+                evicted = []
+                for r_key, r_size in conn.execute("SELECT r_key, r_size FROM results ORDER BY last_used"):
+                    if total_size <= self.max_bytes:
+                        break
+                    evicted.append((r_key,))
+                    total_size -= r_size
+                conn.executemany("DELETE FROM results WHERE r_key = ?", evicted)
+                conn.execute("UPDATE results_size SET total = ?", (total_size,))
+
+            conn.execute("COMMIT")
+
+        except sqlite3.Error as e:
+            print(e)
+            if conn is not None and conn.in_transaction:
+                conn.execute("ROLLBACK")
@@ -0,0 +1,46 @@
+-- noinspection SqlResolveForFile
+
+-- MHcut browser is a web application for browsing data from the MHcut tool.
+-- Copyright (C) 2018-2019  the Canadian Centre for Computational Genomics
+--
+-- This program is free software: you can redistribute it and/or modify
+-- it under the terms of the GNU General Public License as published by
+-- the Free Software Foundation, either version 3 of the License, or
+-- (at your option) any later version.
+--
+-- This program is distributed in the hope that it will be useful,
+-- but WITHOUT ANY WARRANTY; without even the implied warranty of
+-- MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+-- GNU General Public License for more details.
+--
+-- You should have received a copy of the GNU General Public License
+-- along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+-- Must be run after both variants and guides have been ingested, with facet_bin_size as a query parameter.
+
+CREATE TEMPORARY TABLE variant_facets ON COMMIT DROP AS
+  SELECT chr,
+         pos_start / %(facet_bin_size)s AS pos_bin,
+         location,
+         mh_1l,
+         gene_info_clinvar IS NOT NULL AS clinvar,
+         COALESCE(pam_mot > 0, FALSE) AS ngg_pam_avail,
+         COALESCE(pam_uniq > 0, FALSE) AS unique_guide_avail,
+         COALESCE(g.n_guides, 0) AS n_guides
+  FROM variants LEFT JOIN (SELECT variant_id, COUNT(*) AS n_guides FROM guides GROUP BY variant_id) AS g
+    ON variants.id = g.variant_id;
+
+INSERT INTO facet_bin_counts
+  SELECT chr, pos_bin, location, mh_1l, clinvar, ngg_pam_avail, unique_guide_avail, COUNT(*), SUM(n_guides)
+  FROM variant_facets
+  GROUP BY chr, pos_bin, location, mh_1l, clinvar, ngg_pam_avail, unique_guide_avail;
+
+INSERT INTO facet_counts
+  SELECT chr, location, mh_1l, clinvar, ngg_pam_avail, unique_guide_avail, SUM(n_variants), SUM(n_guides)
+  FROM facet_bin_counts
+  GROUP BY chr, location, mh_1l, clinvar, ngg_pam_avail, unique_guide_avail;
+
+CREATE INDEX facet_bin_counts_pos_bin_idx ON facet_bin_counts(pos_bin);
+
+INSERT INTO summary_statistics VALUES('facet_bin_size', %(facet_bin_size)s);
@@ -0,0 +1,35 @@
+-- noinspection SqlResolveForFile
+
+-- MHcut browser is a web application for browsing data from the MHcut tool.
+-- Copyright (C) 2018-2019  the Canadian Centre for Computational Genomics
+--
+-- This program is free software: you can redistribute it and/or modify
+-- it under the terms of the GNU General Public License as published by
+-- the Free Software Foundation, either version 3 of the License, or
+-- (at your option) any later version.
+--
+-- This program is distributed in the hope that it will be useful,
+-- but WITHOUT ANY WARRANTY; without even the implied warranty of
+-- MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+-- GNU General Public License for more details.
+--
+-- You should have received a copy of the GNU General Public License
+-- along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+CREATE INDEX guides_variant_id_idx ON guides(variant_id);
+
+-- Indices for ranking guides across variants (guides are always sorted with NULLS LAST.) inDelphi frequencies are
+-- usually ranked in descending order and mismatch / score columns in ascending order; each index supports top-N
+-- retrieval in its usual direction.
+CREATE INDEX guides_mm0_idx ON guides(mm0);
+CREATE INDEX guides_nmh_score_idx ON guides(nmh_score);
+CREATE INDEX guides_indelphi_freq_mean_idx ON guides(indelphi_freq_mean DESC NULLS LAST);
+CREATE INDEX guides_indelphi_freq_mesc_idx ON guides(indelphi_freq_mesc DESC NULLS LAST);
+CREATE INDEX guides_indelphi_freq_u2os_idx ON guides(indelphi_freq_u2os DESC NULLS LAST);
+CREATE INDEX guides_indelphi_freq_hek293_idx ON guides(indelphi_freq_hek293 DESC NULLS LAST);
+CREATE INDEX guides_indelphi_freq_hct116_idx ON guides(indelphi_freq_hct116 DESC NULLS LAST);
+CREATE INDEX guides_indelphi_freq_k562_idx ON guides(indelphi_freq_k562 DESC NULLS LAST);
+
+-- Composite index for filtering guides of a set of variants by their main quality criterion
+CREATE INDEX guides_variant_id_indelphi_freq_mean_idx ON guides(variant_id, indelphi_freq_mean);
@@ -18,8 +18,12 @@
 DROP TABLE IF EXISTS variants CASCADE;
 DROP TABLE IF EXISTS guides CASCADE;
 DROP TABLE IF EXISTS cartoons CASCADE;
+DROP TABLE IF EXISTS variant_genes CASCADE;
 DROP TABLE IF EXISTS summary_statistics CASCADE;
+DROP TABLE IF EXISTS histograms CASCADE;
 DROP TABLE IF EXISTS entries_query_cache CASCADE;
+DROP TABLE IF EXISTS facet_counts CASCADE;
+DROP TABLE IF EXISTS facet_bin_counts CASCADE;
 
 DROP INDEX IF EXISTS variants_start_idx;
 DROP INDEX IF EXISTS variants_end_idx;
@@ -70,6 +74,21 @@ DROP INDEX IF EXISTS variants_max_indelphi_freq_k562_idx;
 DROP INDEX IF EXISTS variants_full_row_trgm_idx;
 
 DROP INDEX IF EXISTS guides_variant_id_idx;
+DROP INDEX IF EXISTS guides_mm0_idx;
+DROP INDEX IF EXISTS guides_nmh_score_idx;
+DROP INDEX IF EXISTS guides_indelphi_freq_mean_idx;
+DROP INDEX IF EXISTS guides_indelphi_freq_mesc_idx;
+DROP INDEX IF EXISTS guides_indelphi_freq_u2os_idx;
+DROP INDEX IF EXISTS guides_indelphi_freq_hek293_idx;
+DROP INDEX IF EXISTS guides_indelphi_freq_hct116_idx;
+DROP INDEX IF EXISTS guides_indelphi_freq_k562_idx;
+DROP INDEX IF EXISTS guides_variant_id_indelphi_freq_mean_idx;
+
+DROP INDEX IF EXISTS variant_genes_variant_id_idx;
+DROP INDEX IF EXISTS variant_genes_gene_symbol_idx;
+DROP INDEX IF EXISTS variant_genes_gene_id_idx;
+
+DROP INDEX IF EXISTS facet_bin_counts_pos_bin_idx;
 
 DROP TYPE IF EXISTS CHROMOSOME;
 DROP TYPE IF EXISTS VARIANT_LOCATION;
@@ -144,7 +163,7 @@ CREATE TABLE guides (
   mh_dist_2 INTEGER NOT NULL,
   nb_nmh INTEGER, -- NULL means NA
   largest_nmh INTEGER, -- NULL means NA
-  nmh_score TEXT NOT NULL,
+  nmh_score NUMERIC, -- NULL means NA
   nmh_size TEXT,
   nmh_var_l INTEGER, -- NULL means NA
   nmh_gc NUMERIC CHECK (nmh_gc >= 0 AND nmh_gc <= 1), -- NULL means NA
@@ -160,7 +179,15 @@ CREATE TABLE guides (
 
 CREATE TABLE cartoons (
   variant_id INTEGER PRIMARY KEY REFERENCES variants ON DELETE CASCADE,
-  cartoon_text TEXT
+  cartoon_zlib BYTEA -- zlib-compressed UTF-8 cartoon text; cartoons are too small to be compressed by TOAST
+);
+
+-- Normalized gene symbols / IDs, parsed from the composite GENEINFO and GENEINFO.ClinVar columns (SYMBOL:ID|...)
+
+CREATE TABLE variant_genes (
+  variant_id INTEGER NOT NULL REFERENCES variants ON DELETE CASCADE,
+  gene_symbol TEXT NOT NULL,
+  gene_id INTEGER -- NULL means missing / non-numeric ID
 );
 
 CREATE TABLE summary_statistics (
@@ -168,11 +195,46 @@ CREATE TABLE summary_statistics (
   s_value NUMERIC NOT NULL
 );
 
+CREATE TABLE histograms (
+  column_name TEXT NOT NULL,
+  bin INTEGER NOT NULL,
+  bin_start NUMERIC NOT NULL,
+  bin_end NUMERIC NOT NULL,
+  n_variants BIGINT NOT NULL,
+  PRIMARY KEY (column_name, bin)
+);
+
 CREATE TABLE entries_query_cache (
   e_query BYTEA PRIMARY KEY,
   e_value INTEGER NOT NULL
 );
 
+-- Pre-computed variant / guide counts for each combination of sidebar filters, for answering entries queries without
+-- scanning the variants table. facet_bin_counts additionally splits counts by position bin (by pos_start.)
+
+CREATE TABLE facet_counts (
+  chr CHROMOSOME NOT NULL,
+  location VARIANT_LOCATION NOT NULL,
+  mh_1l INTEGER NOT NULL,
+  clinvar BOOLEAN NOT NULL,
+  ngg_pam_avail BOOLEAN NOT NULL,
+  unique_guide_avail BOOLEAN NOT NULL,
+  n_variants BIGINT NOT NULL,
+  n_guides BIGINT NOT NULL
+);
+
+CREATE TABLE facet_bin_counts (
+  chr CHROMOSOME NOT NULL,
+  pos_bin INTEGER NOT NULL, -- pos_start / facet_bin_size (see summary_statistics)
+  location VARIANT_LOCATION NOT NULL,
+  mh_1l INTEGER NOT NULL,
+  clinvar BOOLEAN NOT NULL,
+  ngg_pam_avail BOOLEAN NOT NULL,
+  unique_guide_avail BOOLEAN NOT NULL,
+  n_variants BIGINT NOT NULL,
+  n_guides BIGINT NOT NULL
+);
+
 -- We don't drop and re-create bug_reports, because it should be preserved across imports.
 
 CREATE TABLE IF NOT EXISTS bug_reports (
@@ -180,3 +242,19 @@ CREATE TABLE IF NOT EXISTS bug_reports (
     email TEXT,
     report TEXT
 );
+
+-- Bug reports waiting to be emailed; rows are removed once sent (see bug_reports.py.)
+CREATE TABLE IF NOT EXISTS bug_report_outbox (
+    bug_report_id INTEGER PRIMARY KEY,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    last_error TEXT
+);
+
+CREATE INDEX IF NOT EXISTS bug_report_outbox_next_attempt_idx ON bug_report_outbox(next_attempt);
+
+-- Single-use bug report form tokens, shared by all application worker processes.
+CREATE TABLE IF NOT EXISTS email_tokens (
+    token TEXT PRIMARY KEY,
+    expiry TIMESTAMP WITH TIME ZONE NOT NULL
+);
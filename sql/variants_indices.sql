@@ -64,3 +64,7 @@ CREATE INDEX variants_max_indelphi_freq_hek293_idx ON variants(max_indelphi_freq
 CREATE INDEX variants_max_indelphi_freq_hct116_idx ON variants(max_indelphi_freq_hct116) WHERE max_indelphi_freq_hct116 IS NOT NULL;
 CREATE INDEX variants_max_indelphi_freq_k562_idx ON variants(max_indelphi_freq_k562) WHERE max_indelphi_freq_k562 IS NOT NULL;
 CREATE INDEX variants_full_row_trgm_idx ON variants USING gin(full_row gin_trgm_ops);
+
+CREATE INDEX variant_genes_variant_id_idx ON variant_genes(variant_id);
+CREATE INDEX variant_genes_gene_symbol_idx ON variant_genes(UPPER(gene_symbol));
+CREATE INDEX variant_genes_gene_id_idx ON variant_genes(gene_id) WHERE gene_id IS NOT NULL;
@@ -21,6 +21,8 @@
 import getpass
 import os
 import psycopg2
+import time
+import zlib
 
 from io import StringIO
 from tqdm import tqdm
@@ -32,6 +34,15 @@ CHROMOSOMES = ("chr1", "chr2", "chr3", "chr4", "chr5", "chr6", "chr7", "chr8", "
                "chr11", "chr12", "chr13", "chr14", "chr15", "chr16", "chr17", "chr18", "chr19",
                "chr20", "chr21", "chr22", "chrX", "chrY")
 
+# Size (in bases) of the position bins used for pre-computed facet counts
+FACET_BIN_SIZE = 10000000
+
+# Numeric variant columns to pre-compute histograms for, to be served by the metadata endpoint
+HISTOGRAM_COLUMNS = ("var_l", "flank", "mh_score", "mh_l", "mh_1l", "mh_max_cons", "mh_dist", "mh_1dist", "pam_mot",
+                     "pam_uniq", "guides_no_nmh", "guides_min_nmh", "nbmm", "gc", "max_2_cuts_dist",
+                     "max_indelphi_freq_mean")
+HISTOGRAM_BINS = 20
+
 
 def int_or_null(x):
     """
@@ -63,6 +74,31 @@ def str_or_null(x: str):
     return x.strip() if x != "NA" else "\\N"
 
 
+def parse_gene_info(x: str) -> Tuple[Tuple[str, str], ...]:
+    """
+    Parses a composite gene info string (e.g. PRKN:5071|PARK2:5071) into (symbol, ID) pairs, ready for copying.
+    :param x: The value of a GENEINFO or GENEINFO.ClinVar column.
+    :return: A tuple of (symbol, ID) pairs; IDs which are not integers are backslash-N.
+    """
+
+    x = x.strip()
+    if x in ("", "-", "NA"):
+        return ()
+
+    genes = []
+    for gene in x.split("|"):
+        symbol, _, gene_id = gene.partition(":")
+        if symbol.strip() == "":
+            continue
+        genes.append((symbol.strip(), pos_int_or_null(gene_id.strip())))
+
+    return tuple(genes)
+
+
+def compress_cartoon(cartoon: str) -> bytes:
+    return zlib.compress(cartoon.encode("utf-8"), 9)
+
+
 def schema_setup(conn):
     c = conn.cursor()
 
@@ -87,6 +123,7 @@ def get_n_variants_guides(variants_path: str, guides_path: str) -> Tuple[int, in
 def ingest_variants(conn, variants_path: str, n_variants: int, id_cache: dict):
     c = conn.cursor()
     variant_copy = StringIO()
+    gene_copy = StringIO()
 
     with open(variants_path, "r", newline="") as vs_file:
         # reader = csv.DictReader(vs_file, delimiter="\t")
@@ -172,10 +209,18 @@ def ingest_variants(conn, variants_path: str, n_variants: int, id_cache: dict):
 
             variant_copy.write("\t".join((*main_rows, " ".join(main_rows).lower())) + "\n")
 
+            # De-duplicate genes shared between the dbSNP and ClinVar gene info columns
+            for gene in dict.fromkeys((*parse_gene_info(variant[h_geneinfo]),
+                                       *parse_gene_info(variant[h_geneinfo_clinvar]))):
+                gene_copy.write("\t".join((str(i), *gene)) + "\n")
+
             if i % 500000 == 0:
                 variant_copy.seek(0)
                 c.copy_from(variant_copy, "variants")
                 variant_copy = StringIO()
+                gene_copy.seek(0)
+                c.copy_from(gene_copy, "variant_genes")
+                gene_copy = StringIO()
                 conn.commit()
 
             i += 1
@@ -183,6 +228,8 @@ def ingest_variants(conn, variants_path: str, n_variants: int, id_cache: dict):
     # Copy stragglers
     variant_copy.seek(0)
     c.copy_from(variant_copy, "variants")
+    gene_copy.seek(0)
+    c.copy_from(gene_copy, "variant_genes")
 
     conn.commit()
 
@@ -190,12 +237,6 @@ def ingest_variants(conn, variants_path: str, n_variants: int, id_cache: dict):
     c.execute(open("./sql/variants_indices.sql", "r").read())
     print("\tDone.")
 
-    conn.commit()
-
-    c.execute("INSERT INTO summary_statistics VALUES(%s, (SELECT MIN(pos_start) FROM variants))", ("min_pos",))
-    c.execute("INSERT INTO summary_statistics VALUES(%s, (SELECT MAX(pos_end) FROM variants))", ("max_pos",))
-    c.execute("INSERT INTO summary_statistics VALUES(%s, (SELECT MAX(mh_l) FROM variants))", ("max_mh_l",))
-
     conn.commit()
     c.close()
 
@@ -248,7 +289,7 @@ def ingest_guides(conn, guides_path: str, n_guides: int, id_cache: dict):
             guide_copy.write("\t".join((str(j), str(variant_id), guide[h_protospacer], int_or_null(guide[h_mm0]),
                                         guide[h_m1_dist1], guide[h_m1_dist2], guide[h_mh_dist1],
                                         guide[h_mh_dist2], int_or_null(guide[h_nb_nmh]),
-                                        int_or_null(guide[h_largest_nmh]), guide[h_nmh_score],
+                                        int_or_null(guide[h_largest_nmh]), str_or_null(guide[h_nmh_score]),
                                         int_or_null(guide[h_nmh_size]), int_or_null(guide[h_nmh_var_l]),
                                         nmh_gc, guide[h_nmh_seq], str_or_null(guide[h_in_delphi_freq_mean]),
                                         str_or_null(guide[h_in_delphi_freq_mesc]),
@@ -270,9 +311,9 @@ def ingest_guides(conn, guides_path: str, n_guides: int, id_cache: dict):
 
     conn.commit()
 
-    print("Creating guide index...")
+    print("Creating guide indices...")
 
-    c.execute("CREATE INDEX guides_variant_id_idx ON guides(variant_id)")
+    c.execute(open("./sql/guides_indices.sql", "r").read())
     c.execute("CLUSTER guides USING guides_variant_id_idx")
 
     conn.commit()
@@ -334,7 +375,7 @@ def ingest_cartoons(conn, cartoons_path: str):
                                     v_id = var[0]
 
                                     c.execute("INSERT INTO cartoons VALUES(%s, %s) ON CONFLICT DO NOTHING",
-                                              (v_id, next_cartoon["cartoon"]))
+                                              (v_id, psycopg2.Binary(compress_cartoon(next_cartoon["cartoon"]))))
 
                             except psycopg2.DataError as e:
                                 conn.commit()
@@ -400,6 +441,72 @@ def ingest_cartoons(conn, cartoons_path: str):
     c.close()
 
 
+def compute_facet_counts(conn):
+    c = conn.cursor()
+
+    print("Computing facet counts...")
+
+    with open("./sql/facet_counts.sql", "r") as f:
+        c.execute(f.read(), {"facet_bin_size": FACET_BIN_SIZE})
+
+    print("\tDone.")
+
+    conn.commit()
+    c.close()
+
+
+def compute_summary_statistics(conn):
+    """
+    Pre-computes all aggregates served by the metadata endpoint, and stamps the dataset with a new version (the
+    import time) so that cached responses for the previous data are invalidated.
+    """
+
+    c = conn.cursor()
+
+    print("Computing summary statistics...")
+
+    c.execute("INSERT INTO summary_statistics SELECT 'min_pos', MIN(pos_start) FROM variants")
+    c.execute("INSERT INTO summary_statistics SELECT 'max_pos', MAX(pos_end) FROM variants")
+    c.execute("INSERT INTO summary_statistics SELECT 'max_mh_l', MAX(mh_l) FROM variants")
+    c.execute("INSERT INTO summary_statistics SELECT 'max_mh_1l', MAX(mh_1l) FROM variants")
+    c.execute("INSERT INTO summary_statistics SELECT 'n_variants', COUNT(*) FROM variants")
+    c.execute("INSERT INTO summary_statistics SELECT 'n_guides', COUNT(*) FROM guides")
+    c.execute("INSERT INTO summary_statistics SELECT 'n_cartoons', COUNT(*) FROM cartoons")
+
+    c.execute("INSERT INTO summary_statistics "
+              "SELECT 'min_pos_' || CAST(chr AS TEXT), MIN(pos_start) FROM variants GROUP BY chr")
+    c.execute("INSERT INTO summary_statistics "
+              "SELECT 'max_pos_' || CAST(chr AS TEXT), MAX(pos_end) FROM variants GROUP BY chr")
+    c.execute("INSERT INTO summary_statistics "
+              "SELECT 'n_variants_' || CAST(chr AS TEXT), COUNT(*) FROM variants GROUP BY chr")
+
+    for col in tqdm(HISTOGRAM_COLUMNS, desc="histograms"):
+        c.execute(f"SELECT MIN({col}), MAX({col}) FROM variants")
+        col_min, col_max = c.fetchone()
+
+        if col_min is None:
+            # Column is entirely null
+            continue
+
+        c.execute(f"INSERT INTO histograms "
+                  f"SELECT %(col)s, bin, %(min)s + (bin - 1) * %(width)s, %(min)s + bin * %(width)s, COUNT(*) "
+                  f"FROM (SELECT CAST(LEAST(FLOOR(({col} - %(min)s) / %(width)s) + 1, %(bins)s) AS INTEGER) AS bin "
+                  f"      FROM variants WHERE {col} IS NOT NULL) AS variant_bins "
+                  f"GROUP BY bin", {
+                      "col": col,
+                      "min": col_min,
+                      "width": (col_max - col_min) / HISTOGRAM_BINS if col_max > col_min else 1,
+                      "bins": HISTOGRAM_BINS
+                  })
+
+    c.execute("INSERT INTO summary_statistics VALUES('dataset_version', %s)", (int(time.time()),))
+
+    print("\tDone.")
+
+    conn.commit()
+    c.close()
+
+
 def main():
     """
     Main method, runs when the script is run directly.
@@ -434,9 +541,15 @@ def main():
     # Ingest guides
     ingest_guides(conn, guides_path, n_guides, id_cache)
 
+    # Pre-compute sidebar filter counts
+    compute_facet_counts(conn)
+
     # Ingest cartoons
     ingest_cartoons(conn, cartoons_path)
 
+    # Pre-compute metadata and stamp the dataset version
+    compute_summary_statistics(conn)
+
     conn.close()
 
 
@@ -192,3 +192,9 @@ export const GUIDES_LAYOUT = [
         optional_columns: ["nmh_gc"]
     }
 ];
+
+// Maximum number of variants to request cartoons for at once (must not exceed MAX_BATCH_IDS in application.py)
+export const CARTOONS_BATCH_SIZE = 500;
+
+// Maximum number of variants to request guides for at once (must not exceed MAX_BATCH_IDS in application.py)
+export const VARIANT_GUIDES_BATCH_SIZE = 500;
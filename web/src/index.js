@@ -26,7 +26,9 @@ import {
     COLUMN_HELP_TEXT,
     DATASET_HELP_TEXT,
     VARIANTS_LAYOUT,
-    GUIDES_LAYOUT
+    GUIDES_LAYOUT,
+    CARTOONS_BATCH_SIZE,
+    VARIANT_GUIDES_BATCH_SIZE
 } from "./constants";
 
 let datasets = [];
@@ -38,6 +40,9 @@ let page = 1;
 let itemsPerPage = 100;
 let loadedVariants = [];
 let loadedGuides = [];
+
+// All guides (i.e. not filtered) for variants of the currently-loaded page, by variant ID, fetched in batches
+let variantGuides = {variants: loadedVariants, guides: new Map()};
 let totalVariantsCount = 0;
 let totalGuidesCount = 0;
 
@@ -199,6 +204,8 @@ document.addEventListener("DOMContentLoaded", async function () {
     populateEntryTable();
     updateTableColumnHeaders();
 
+    loadCartoons().catch(err => console.error(err));
+
     d3.select("#view-variants").on("click", () => selectTablePage("variants"));
     d3.select("#view-guides").on("click", () => selectTablePage("guides"));
 
@@ -628,16 +635,16 @@ function populateEntryTable() {
             variantGuidesModal.show();
             d3.select("#variant-for-guides").text(e["id"]);
 
-            const guides = await fetchJSON(`/api/datasets/${selectedDataset}/variants/${e["id"]}/guides`);
-            const variantGuides = d3.select("#variant-guides-table tbody")
+            const guides = await getVariantGuides(e["id"]);
+            const variantGuidesRows = d3.select("#variant-guides-table tbody")
                 .selectAll("tr")
                 .data(guides, g => g["id"]);
-            const variantGuideEntry = variantGuides.enter().append("tr");
+            const variantGuideEntry = variantGuidesRows.enter().append("tr");
             headersFromLayout(GUIDES_LAYOUT, true).forEach(h => variantGuideEntry.append("td")
                 .attr("class", e => getTableCellClasses(e, h))
                 .append("div")
                 .html(e => getTableCellContents(e, h)));
-            variantGuides.exit().remove();
+            variantGuidesRows.exit().remove();
             d3.select("#export-variant-guides").on("click", () => {
                 const downloadURL = new URL(`/api/datasets/${selectedDataset}/variants/${e["id"]}/guides/tsv`,
                     window.location.origin);
@@ -720,6 +727,8 @@ function getTableCellContents(e, f) {
         return `<a href="${clinVarURL(e["allele_id"])}/" target="_blank" rel="noopener">${e["allele_id"]}</a>`;
     } else if (f.column === "pam_mot" && e["pam_mot"] !== null && e["pam_mot"] > 0) {
         return `<strong><a class="show-guides-modal">${e["pam_mot"]}</a></strong>`;
+    } else if (f.column === "cartoon" && e["cartoon"] === undefined) {
+        return ""; // Not loaded yet
     } else if (f.column === "cartoon" && e["cartoon"] !== null) {
         return `<pre>${e["cartoon"]}</pre>`;
     } else if (f.column.includes("indelphi") && e[f.column] !== null) {
@@ -855,6 +864,8 @@ async function reloadPage(reloadCounts) {
 
         updatePagination();
 
+        loadCartoons().catch(err => console.error(err));
+
         if (reloadCounts && loadingEntryCounts && loadedVariants.length !== 0) {
             [totalVariantsCount, totalGuidesCount] = await Promise.all([
                 fetchJSON(variantCountURL.toString()),
@@ -890,6 +901,57 @@ async function reloadPage(reloadCounts) {
     }
 }
 
+/**
+ * Loads cartoons for the currently-loaded variants separately from the variants themselves (in batches), and fills
+ * them into the table once available.
+ */
+async function loadCartoons() {
+    const variants = loadedVariants;
+
+    for (let i = 0; i < variants.length; i += CARTOONS_BATCH_SIZE) {
+        const batch = variants.slice(i, i + CARTOONS_BATCH_SIZE);
+        const cartoons = await fetchJSON(`/api/datasets/${selectedDataset}/cartoons?ids=${
+            batch.map(v => v["id"]).join(",")}`);
+
+        if (variants !== loadedVariants) return; // Another page has since been loaded
+
+        batch.forEach(v => v["cartoon"] = cartoons.hasOwnProperty(v["id"]) ? cartoons[v["id"]] : null);
+
+        if (dataDisplay === "variants") {
+            d3.selectAll("table#entry-table tbody td.variants-column__cartoon > div")
+                .html(e => getTableCellContents(e, {column: "cartoon"}));
+        }
+    }
+}
+
+/**
+ * Gets all guides for a variant of the currently-loaded page. The first time guides are needed for a page, they are
+ * loaded for all of its variants with guides at once (in batches), so that viewing the guides of other variants on the
+ * same page does not require another request.
+ * @param {number} variantID
+ * @returns {Promise<Array>}
+ */
+async function getVariantGuides(variantID) {
+    if (variantGuides.variants !== loadedVariants) {
+        variantGuides = {variants: loadedVariants, guides: new Map()};
+    }
+
+    const cache = variantGuides.guides;
+    if (!cache.has(variantID)) {
+        const ids = [variantID, ...loadedVariants
+            .filter(v => v["id"] !== variantID && v["pam_mot"] > 0 && !cache.has(v["id"]))
+            .map(v => v["id"])];
+
+        for (let i = 0; i < ids.length; i += VARIANT_GUIDES_BATCH_SIZE) {
+            const guides = await fetchJSON(`/api/datasets/${selectedDataset}/variants/guides?ids=${
+                ids.slice(i, i + VARIANT_GUIDES_BATCH_SIZE).join(",")}`);
+            Object.entries(guides).forEach(([id, g]) => cache.set(parseInt(id, 10), g));
+        }
+    }
+
+    return cache.get(variantID);
+}
+
 /**
  * Gets the total number of pages based on items per page and total loaded variants count.
  * @returns {string}
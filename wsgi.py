@@ -2,7 +2,7 @@
 
 import os
 
-from application import app as application
+from application import app as application, start_prewarm_result_cache
 
 os.environ["DB_NAME_CAS"] = "your_production_db_name_cas"
 os.environ["DB_NAME_XCAS"] = "your_production_db_name_xcas"
@@ -13,5 +13,12 @@ os.environ["GMAIL_SENDER_EMAIL"] = "your_production_gmail_sender_email"
 os.environ["GMAIL_SENDER_PASSWORD"] = "your_production_gmail_sender_password"
 os.environ["BUG_REPORT_EMAIL"] = "your_production_bug_report_email"
 
+try:
+    # Under uWSGI, the application is loaded in the master process; pre-warm after forking into the workers instead.
+    from uwsgidecorators import postfork
+    postfork(start_prewarm_result_cache)
+except ImportError:
+    start_prewarm_result_cache()
+
 if __name__ == "__main__":
     application.run()